@@ -22,43 +22,66 @@ import time # Allows the tracking of time
 import os # Allows access to (sub)folders
 import pdb # Allows tracing/breakpoints using pdb.set_trace()
 import shutil # Allows the copying of files
-import pickle # Allows the saving/loading of variables
+import cPickle as pickle # Allows the saving/loading of variables (C implementation of pickle)
+import hashlib # Allows the detection of changes in the data files
 import sys, traceback # Allows the tracing of errors using traceback.print_exc(file=sys.stdout)
 from itertools import chain, combinations # Allows the creation of all subsets of a set
 import datetime # Allows conversion of excel's ridiculous date format
+import argparse # Allows running scenarios from the command line (without GUI)
+from multiprocessing.pool import ThreadPool # Allows reading the data files concurrently
+import json # Allows writing the profiling report
+import gc # Allows counting objects for the profiling report
+import tempfile # Allows the solver to exchange files outside of the script's folder
+import subprocess # Allows handing the model to CBC through a pipe (see PipedCBC)
+import ctypes # Allows measuring the peak memory use for the profiling report on Windows
+try:
+    import resource # Allows measuring the peak memory use for the profiling report (not available on Windows)
+except ImportError:
+    resource = None
 
 class UNWFPModel:
-    def __init__(self, root):
+    DATA_VERSION = 6 # Version of the stored data (data.pickle); increase whenever the loaded data changes structure
+    MONTHS = ["Jan","Feb","Mar","Apr","May","Jun","Jul","Aug","Sep","Oct","Nov","Dec"]
+    SOLVED = ["Optimal","Feasible (time limit)"] # Solver outcomes with a usable solution (see calculate(self, NAME))
+    XLDATES = {} # Memoised Excel date conversions (see xldate2month(self, DATE, TYPE))
+    # Decision variables and statistics indexed by period (see prep_window(self))
+    VARIABLES = ["R","CV","K","G","FCSG","S","O","SFI","P","LT"]
+    STATISTICS = ["PC_I","PC_L","PC_CV","PC_R","PC","TR_OC","TR_OL","TR_IL","TR","HC","LOAD","LOAD_F","LOAD_CV","ODOC_CV","ODOC_F","ODOC","DOC","DSC","TDC","ISC","TC","NVS","COMS","GROUPS","FCS","KCAL","PROT","FAT","MT_I","MT_R","MT_L","MT_CV","MT","LTsum"]
+    TOTALS = ["PC_I","PC_L","PC_CV","PC_R","PC","TR_OC","TR_OL","TR_IL","TR","HC","ODOC_CV","ODOC_F","ODOC","DOC","DSC","TDC","ISC","TC","NVS","COMS","GROUPS","FCS","KCAL","PROT","FAT","MT_I","MT_R","MT_L","MT_CV","MT","LTsum"]
+    AVERAGES = ["PC_I","PC_L","PC_CV","PC_R","PC","TR_OC","TR_OL","TR_IL","TR","HC","ODOC_CV","ODOC_F","ODOC","DOC","DSC","TDC","ISC","TC","MT_I","MT_R","MT_L","MT_CV","MT","LTsum"] # NB: averages of nutritional statistics are set in calculate(self, NAME)
+    BACKENDS = {"CBC": ["PULP_CBC_CMD","COIN_CMD"], "GLPK": ["GLPK_CMD"], "HiGHS": ["HiGHS_CMD","HIGHS_CMD"]} # PuLP solver classes per backend, in order of preference (see backends(self))
+
+    def __init__(self, root=None):
         '''
         This code runs automatically when the file is opened.
         It loads the data from UpdateValues.xlsm and creates the GUI.
+        Without a root window the model is set up headless (see init_headless(self)).
         '''
 
         print "Welcome to AID-M: WFP's Assistant for Integrated Decision-Making"
         print " "
 
-        # Load data
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        dest_dir = os.path.join(script_dir, 'data')
-        path = os.path.join(dest_dir, 'Check.csv')
-        out = open(path,"rb")
-        c = csv.reader(out, dialect='excel')
-        check = next(c,None)[0]
-        out.close()
-        if check == "1":
-            print "No change in data detected"
-            print "Loading data from previous state..."
-            self.load_quick()
-        else:
-            print "New data detected"
-            print "Loading data from file..."
-            self.load_thorough()
+        # Load data (only the .csv files that changed since the previous session are reprocessed)
+        self.profile = [] # Wall time, memory use and object counts of each phase (see record(self,PHASE,tick,NOTE))
+        self.load_changes()
         print "Data loaded!"
         print " "
+        self.writelp = 0 # Debug mode: write each model to AIDM.lp before solving it
+        self.tighten = 1 # Big-M presolve (see presolve(self)); switch off to compare solve times with the generic big-Ms
+        self.warmstart = 0 # Sweeps: pass the previous solution (self.incumbent) to the solver as a starting point
+        self.incumbent = {}
+
+        # Run without GUI (command line / batch servers)
+        if root is None:
+            self.init_headless()
+            print "Ready to solve scenarios (no GUI)"
+            print " "
+            return
 
         # Create GUI
         print "Creating GUI..."
         print " "
+        self.gui = 1
         self.draw_GUI(root)
         print "Ready when you are!"
         print " "
@@ -72,6 +95,134 @@ class UNWFPModel:
         that were prepared through UpdateValues.xlsm.
         '''
 
+        tick = time.time()
+        stages = self.data_stages()
+        rows = self.read_data([name for stage in stages for name in stage[2]])
+        tick = self.record("Load: Read files",tick)
+        for stage in stages:
+            stage[1](rows)
+            tick = self.record("Load: " + stage[0],tick)
+        self.datahash = self.data_hashes()
+        self.store_data()
+        self.record("Load: Store data",tick)
+
+    def load_changes(self):
+        '''
+        Load the data from the previous session and only reprocess the .csv files that changed since.
+        Each .csv file is identified by a hash of its contents, so it doesn't matter how or when the file was modified.
+        Stages that depend on a reprocessed stage are rerun as well (see data_stages(self)).
+        '''
+
+        tick = time.time()
+        hashes = self.data_hashes()
+        try:
+            self.load_quick()
+            old = self.datahash
+        except:
+            old = {} # No (compatible) data from a previous session
+        tick = self.record("Load: Previous state",tick)
+        changed = [name for name in hashes.keys() if old.get(name) != hashes[name]]
+        if changed == []:
+            print "No change in data detected"
+            print "Loading data from previous state..."
+            return
+        changed.sort()
+        print "New data detected:"
+        for name in changed:
+            print "> " + name
+        print "Loading data from file..."
+        rerun = []
+        for stage in self.data_stages():
+            if [f for f in stage[2] if f in changed] != [] or [d for d in stage[3] if d in rerun] != []:
+                rerun.append(stage)
+        rows = self.read_data([name for stage in rerun for name in stage[2]])
+        tick = self.record("Load: Read files",tick)
+        for stage in rerun:
+            stage[1](rows)
+            tick = self.record("Load: " + stage[0],tick)
+        self.datahash = hashes
+        self.store_data()
+        self.record("Load: Store data",tick)
+
+    def data_stages(self):
+        '''
+        Returns the stages of loading the data in the order in which they have to be run
+        Each stage is defined as [name, function, .csv files read by the stage, stages it depends on]
+        The functions are called with the rows of the .csv files (see read_data(self,names))
+        '''
+
+        stages = []
+        stages.append(["Network", self.load_network, ['Nutritional Values.csv','Nutritional Requirements.csv','Beneficiary Allocations.csv',
+                                                      'Discharge Ports.csv','Extended Delivery Points.csv','SCIPS Routes.csv','Shipping Times.csv',
+                                                      'Port Processing Times.csv','Overland Routes.csv','Local Procurement Routes.csv','C&V Routes.csv',
+                                                      'SCIPS Prices.csv','VAM Prices.csv','DP2EDP Transport.csv','DP2DP Transport.csv',
+                                                      'EDP2FDP Transport.csv','EDP2EDP Transport.csv'], []])
+        stages.append(["Support Costs", self.load_support, ['Support Costs.csv'], []])
+        stages.append(["Inventories", self.load_inventories, ['Initial Inventory (DP).csv','Initial Inventory (EDP).csv'], ["Network"]])
+        stages.append(["Demands", self.load_demands, ['Activity Rations.csv','Tactical Demand.csv'], ["Network"]])
+        stages.append(["Forecasts", self.load_forecasts, ['Price Seasonality.csv','Supplier Capacity.csv'], ["Network"]])
+        return stages
+
+    def read_data(self,names):
+        '''
+        Read the .csv files concurrently, so that loading isn't slowed down by waiting on each file in turn
+        Returns {file name: list of rows}; the rows are linked into the model afterwards by the data stages
+        '''
+
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        dest_dir = os.path.join(script_dir, 'data')
+        def read(name):
+            f = open(os.path.join(dest_dir, name),"r")
+            rows = list(csv.reader(f))
+            f.close()
+            return rows
+        pool = ThreadPool(min(len(names),8))
+        try:
+            data = pool.map(read, names)
+        finally:
+            pool.close()
+            pool.join()
+        return dict(zip(names, data))
+
+    def data_hashes(self):
+        '''
+        Returns the MD5 hash of each .csv file that is read by the data stages
+        '''
+
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        dest_dir = os.path.join(script_dir, 'data')
+        hashes = {}
+        for stage in self.data_stages():
+            for name in stage[2]:
+                f = open(os.path.join(dest_dir, name),'rb')
+                hashes[name] = hashlib.md5(f.read()).hexdigest()
+                f.close()
+        return hashes
+
+    def store_data(self):
+        '''
+        Store the processed data so that the next session can skip the files that didn't change
+        The snapshot is a versioned cPickle of the loaded data (see DATA_VERSION), which load_quick(self) reads back in full
+        NB: The snapshot is not integer-coded, array-backed or memory-mapped, so several workers can't share it read-only: each process loads its own copy (~0.8 MB in ~0.04 seconds)
+        ~~~~~~~~~~~~~ TO DO: a shared (mmap) snapshot, once the model data is keyed by integer ids instead of names ~~~~~~~~~~~~~
+        '''
+
+        print "Storing data inputs..."
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        dest_dir = os.path.join(script_dir, 'data')
+        path = os.path.join(dest_dir, 'data.pickle')
+        data = vars(self).copy() # NB: This runs before the GUI is created, so only the loaded data is stored
+        data.pop("profile",None)
+        f = open(path,'wb')
+        pickle.dump(self.DATA_VERSION,f,pickle.HIGHEST_PROTOCOL)
+        pickle.dump(data,f,pickle.HIGHEST_PROTOCOL)
+        f.close()
+
+    def load_network(self,rows):
+        '''
+        Load the nutritional data, demand, nodes, routes and procurement options, and connect them into the supply chain network
+        '''
+
         print "Loading nutritional data..."
         # FCS is predefined
         self.fcsgroups = ["Main staples","Pulses","Vegetables","Fruit","Meat and fish","Milk","Sugar","Oil","Condiments","Other"]
@@ -87,11 +238,7 @@ class UNWFPModel:
         self.weight["Condiments"] = 0
         self.weight["Other"] = 0 # to handle exceptions and SNFs
         # Grab nutritional data for each commodity from NutVal
-        fileloc = os.path.dirname(os.path.abspath(__file__))
-        dataloc = os.path.join(fileloc,'data')
-        csvloc = os.path.join(dataloc,'Nutritional Values.csv')
-        f = open(csvloc,"r")
-        myreader = csv.reader(f)
+        myreader = iter(rows['Nutritional Values.csv'])
         # Define the sets
         self.supcom = [] # Commodity archetype
         self.commodities = [] # Specific commodity
@@ -119,7 +266,6 @@ class UNWFPModel:
                 else:
                     print "<<<Warning>>> " + item[i+1] + " is not an FCS food group"
                     self.fcs[item[1]]="Other"
-        f.close()
         # Remove duplicates from sets
         self.commodities = list(set(self.commodities)) # By making a set of the food groups we remove double entries. Turning it into a list again allows for easier use of this set
         self.commodities.sort()
@@ -128,9 +274,7 @@ class UNWFPModel:
         self.foodgroups = list(set(self.foodgroups))
         self.foodgroups.sort()
         # Grab the nutritional requirements for each beneficiary type
-        csvloc = os.path.join(dataloc,'Nutritional Requirements.csv')
-        f = open(csvloc,"r")
-        myreader = csv.reader(f)
+        myreader = iter(rows['Nutritional Requirements.csv'])
         self.beneficiaries = []
         self.benlist = []
         self.nutreq = {}
@@ -145,12 +289,9 @@ class UNWFPModel:
                 i+=1
             if v>0:
                 self.benlist.append(item[0])
-        f.close()
 
         print "Loading beneficiary allocations..."
-        csvloc = os.path.join(dataloc,'Beneficiary Allocations.csv')
-        f = open(csvloc,"r")
-        myreader = csv.reader(f)
+        myreader = iter(rows['Beneficiary Allocations.csv'])
         self.FDPs = []
         self.periods = next(myreader,None)[3:]
         self.hc = {}
@@ -171,7 +312,6 @@ class UNWFPModel:
                 i+=1
             if v>0:
                 check.append(item[0])
-        f.close()
         # Filter
         self.FDPs=list(set(self.FDPs))
         self.FDPs.sort()
@@ -185,9 +325,7 @@ class UNWFPModel:
                         self.dem[b,i,t] = 0  # makes constraints easier to define
 
         print "Loading node capacities..."
-        csvloc = os.path.join(dataloc,'Discharge Ports.csv')
-        f = open(csvloc,"r")
-        myreader = csv.reader(f)
+        myreader = iter(rows['Discharge Ports.csv'])
         self.DPs = []
         self.nodecap = {}
         self.sc = {}
@@ -202,10 +340,7 @@ class UNWFPModel:
                 i+=1
         self.DPs=list(set(self.DPs))
         self.DPs.sort()
-        f.close()
-        csvloc = os.path.join(dataloc,'Extended Delivery Points.csv')
-        f = open(csvloc,"r")
-        myreader = csv.reader(f)
+        myreader = iter(rows['Extended Delivery Points.csv'])
         self.EDPs = []
         next(myreader,None)
         for item in myreader:
@@ -218,24 +353,9 @@ class UNWFPModel:
                 i+=1
         self.EDPs=list(set(self.EDPs))
         self.EDPs.sort()
-        f.close()
-
-        print "Loading support costs..."
-        csvloc = os.path.join(dataloc,'Support Costs.csv')
-        f = open(csvloc,"r")
-        myreader = csv.reader(f)
-        next(myreader,None)
-        self.odocF = float(next(myreader,None)[1])
-        self.odocCV = float(next(myreader,None)[1])
-        self.dsc = float(next(myreader,None)[1])
-        self.isc = float(next(myreader,None)[1])
-        self.ltsh = float(next(myreader,None)[1])
-        f.close()
 
         print "Loading upstream routes..."
-        csvloc = os.path.join(dataloc,'SCIPS Routes.csv')
-        f = open(csvloc,"r")
-        myreader = csv.reader(f)
+        myreader = iter(rows['SCIPS Routes.csv'])
         next(myreader,None)
         self.ISs = []
         self.missingcoms = []
@@ -251,33 +371,29 @@ class UNWFPModel:
                     self.missingcoms.append(item[2])
         self.ISs = list(set(self.ISs))
         self.ISs.sort()
-        f.close()
+        shipping = {} # (lp, dp) -> shipping connections, so the overlays below only visit routes that exist
+        for key in self.dur.keys(): # key = (lp, dp, com)
+            shipping.setdefault((key[0],key[1]),[]).append(key)
+        ports = {} # dp -> shipping connections
+        for key in self.dur.keys():
+            ports.setdefault(key[1],[]).append(key)
         # Overwrite lead times with historical values if not specified explicitly
-        csvloc = os.path.join(dataloc,'Shipping Times.csv')
-        f = open(csvloc,"r")
-        myreader = csv.reader(f)
+        myreader = iter(rows['Shipping Times.csv'])
         next(myreader,None)
         for item in myreader:
             if item[1] in self.DPs:
-                for k in self.commodities:
-                    if (item[0],item[1],k) in self.dur.keys():
-                        if self.dur[item[0],item[1],k]==0:
-                            self.dur[item[0],item[1],k]=float(item[2])
+                for key in shipping.get((item[0],item[1]),[]):
+                    if self.dur[key]==0:
+                        self.dur[key]=float(item[2])
         # Add port processing times to shipping connections
-        csvloc = os.path.join(dataloc,'Port Processing Times.csv')
-        f = open(csvloc,"r")
-        myreader = csv.reader(f)
+        myreader = iter(rows['Port Processing Times.csv'])
         next(myreader,None)
         for item in myreader:
             if item[0] in self.DPs:
-                for lp in self.ISs:
-                    for k in self.commodities:
-                        if (lp,item[0],k) in self.dur.keys():
-                            self.dur[lp,item[0],k]+=float(item[1])
+                for key in ports.get(item[0],[]):
+                    self.dur[key]+=float(item[1])
 
-        csvloc = os.path.join(dataloc,'Overland Routes.csv')
-        f = open(csvloc,"r")
-        myreader = csv.reader(f)
+        myreader = iter(rows['Overland Routes.csv'])
         next(myreader,None)
         self.RSs = []
         for item in myreader:
@@ -288,14 +404,11 @@ class UNWFPModel:
                     self.dur[item[0],item[1],k] = float(item[3])
         self.RSs = list(set(self.RSs))
         self.RSs.sort()
-        f.close()
         for city in self.RSs:
             if city in self.ISs:
                 self.ISs.remove(city) # RMs and LPs should not overlap; otherwise some procurement costs will be counted twice
 
-        csvloc = os.path.join(dataloc,'Local Procurement Routes.csv')
-        f = open(csvloc, "r")
-        myreader = csv.reader(f)
+        myreader = iter(rows['Local Procurement Routes.csv'])
         next(myreader,None)
         self.LSs= []
         for item in myreader:
@@ -306,11 +419,8 @@ class UNWFPModel:
                     self.dur[item[0],item[1],k] = float(item[3])
         self.LSs = list(set(self.LSs))
         self.LSs.sort()
-        f.close()
 
-        csvloc = os.path.join(dataloc,'C&V Routes.csv')
-        f = open(csvloc,"r")
-        myreader = csv.reader(f)
+        myreader = iter(rows['C&V Routes.csv'])
         next(myreader,None)
         self.LMs = []
         for item in myreader:
@@ -321,12 +431,9 @@ class UNWFPModel:
                     self.dur[item[0],item[1],k] = float(item[3])
         self.LMs = list(set(self.LMs))
         self.LMs.sort()
-        f.close()
 
         print "Loading procurement options..."
-        csvloc = os.path.join(dataloc,'SCIPS Prices.csv')
-        f = open(csvloc,"r")
-        myreader = csv.reader(f)
+        myreader = iter(rows['SCIPS Prices.csv'])
         self.proccap = {}
         self.date = {}
         self.isGMO = {}
@@ -352,7 +459,6 @@ class UNWFPModel:
                         self.incoterms.append(item[2])
                     else:
                         self.missingcoms.append(item[4])
-        f.close()
         self.countries = list(set(self.countries))
         self.countries.sort()
         self.incoterms = list(set(self.incoterms))
@@ -360,11 +466,9 @@ class UNWFPModel:
         self.sources = list(set(self.sources))
         self.sources.sort()
 
-        csvloc = os.path.join(dataloc,'VAM Prices.csv')
-        f = open(csvloc,"r")
         src = "Local Markets - C&V"
         self.sources.append(src) # Create a new source for C&V purchases
-        myreader = csv.reader(f)
+        myreader = iter(rows['VAM Prices.csv'])
         next(myreader,None)
         for item in myreader:
             if item[1] in self.commodities:
@@ -374,7 +478,6 @@ class UNWFPModel:
                 self.isGMO[src, item[0],item[1]] = float(item[5])
             else:
                 self.missingcoms.append(item[1])
-        f.close()
 
         print "Cross-referencing..."
         # Warning: Missing commodities
@@ -386,48 +489,44 @@ class UNWFPModel:
                 print "  Missing: " + item
             print "If you want any of these commodities to be considered for purchase, add them to the NutVal tab in UpdateValues.xlsm"
             print " "
+        # Index the connections once, so that the filter below doesn't need to scan self.cost for every key
+        srcset = set(self.sources)
+        supply = {} # (ndp, com) -> sources that sell the commodity at the ndp
+        reach = {} # (location, com) -> destinations the commodity can be moved to from the location
+        for key in self.cost.keys():
+            if key[0] in srcset:
+                supply.setdefault((key[1],key[2]),set()).add(key[0])
+            else:
+                reach.setdefault((key[0],key[2]),set()).add(key[1])
+        onward = {} # Valid destinations for each type of ndp
+        for ndp in self.ISs:
+            onward[ndp] = set(self.DPs)
+        for ndp in self.RSs:
+            onward[ndp] = onward.get(ndp,set()) | set(self.DPs+self.EDPs)
+        for ndp in self.LSs:
+            onward[ndp] = onward.get(ndp,set()) | set(self.EDPs)
+        for ndp in self.LMs:
+            onward[ndp] = onward.get(ndp,set()) | set(self.FDPs)
+        DPset = set(self.DPs)
         # Filter self.cost (remove loose ends)
         disc_r = 0
         disc_p = 0
         self.avail = [] # The subset of commodities that is actually available for purchase
         temp=[]
         for key in self.cost.keys():
-            if key[0] not in self.sources: # key = (ndp, location inside country, com)
-                check = 0
-                for src in self.sources:
-                    if (src,key[0],key[2]) in self.cost.keys():
-                        check = 1 # Commodity can be procured
-                        self.avail.append(key[2])
-                        break
-                if check == 0 and key[0] not in self.DPs: # Routing option doesn't connect with a sourcing option
+            if key[0] not in srcset: # key = (ndp, location inside country, com)
+                if supply.get((key[0],key[2])):
+                    self.avail.append(key[2]) # Commodity can be procured
+                elif key[0] not in DPset: # Routing option doesn't connect with a sourcing option
                     self.cost.pop(key,None) # Remove the option from consideration
+                    reach[key[0],key[2]].discard(key[1])
                     disc_r += 1
             else: # key = (src, ndp, com)
-                check = 0
-                if key[1] in self.ISs:
-                    for dp in self.DPs:
-                        if (key[1],dp,key[2]) in self.cost.keys():
-                            check = 1 # Commodity can be shipped
-                            break
-                if key[1] in self.RSs:
-                    for i in (self.DPs+self.EDPs):
-                        if (key[1],i,key[2]) in self.cost.keys():
-                            check = 1 # Commodity can be shipped or transported overland
-                            break
-                if key[1] in self.LSs:
-                    for edp in self.EDPs:
-                        if (key[1],edp,key[2]) in self.cost.keys():
-                            check = 1 # Commodity can be transported inland
-                            break
-                if key[1] in self.LMs:
-                    for fdp in self.FDPs:
-                        if (key[1],fdp,key[2]) in self.cost.keys():
-                            check = 1 # Commodity can be transported inland
-                            break
-                if check == 0: # Procurement option doesn't connect with a routing option
+                if reach.get((key[1],key[2]),set()).isdisjoint(onward.get(key[1],())): # Procurement option doesn't connect with a routing option
                     self.cost.pop(key,None) # Remove the option from consideration
                     self.proccap.pop(key,None)
                     self.isGMO.pop(key,None)
+                    supply[key[1],key[2]].discard(key[0])
                     disc_p +=1
                     temp.append(key)
         print "Removed " + str(disc_r) + " disconnected routes"
@@ -446,8 +545,9 @@ class UNWFPModel:
                     break
             if check == 0:
                 self.supcom.remove(s)
+        comset = set(self.commodities)
         for key in self.cost.keys():
-            if key[2] not in self.commodities:
+            if key[2] not in comset:
                 self.cost.pop(key,None)
         # Warn user of disconnected procurement options
         if len(temp) > 0:
@@ -465,9 +565,7 @@ class UNWFPModel:
             self.user_add_com[k]=[0,1000] # g/p/d of each commodity is between 0-1000g
 
         print "Loading downstream routes..."
-        csvloc = os.path.join(dataloc,'DP2EDP Transport.csv')
-        f = open(csvloc,"r")
-        myreader = csv.reader(f)
+        myreader = iter(rows['DP2EDP Transport.csv'])
         next(myreader,None)
         self.arccap = {}
         for item in myreader:
@@ -479,10 +577,7 @@ class UNWFPModel:
                 for k in self.commodities:
                     self.cost[item[0],item[1],k] = float(item[2])
                     self.dur[item[0],item[1],k] = float(item[3])
-        f.close()
-        csvloc = os.path.join(dataloc,'DP2DP Transport.csv')
-        f = open(csvloc,"r")
-        myreader = csv.reader(f)
+        myreader = iter(rows['DP2DP Transport.csv'])
         next(myreader,None)
         for item in myreader:
             if item[0] in self.DPs and item[1] in self.DPs:
@@ -493,10 +588,7 @@ class UNWFPModel:
                 for k in self.commodities:
                     self.cost[item[0],item[1],k] = float(item[2])
                     self.dur[item[0],item[1],k] = float(item[3])
-        f.close()
-        csvloc = os.path.join(dataloc,'EDP2FDP Transport.csv')
-        f = open(csvloc,"r")
-        myreader = csv.reader(f)
+        myreader = iter(rows['EDP2FDP Transport.csv'])
         next(myreader,None)
         for item in myreader:
             if item[0] in self.EDPs and item[1] in self.FDPs:
@@ -507,10 +599,7 @@ class UNWFPModel:
                 for k in self.commodities:
                     self.cost[item[0],item[1],k] = float(item[2])
                     self.dur[item[0],item[1],k] = float(item[3])
-        f.close()
-        csvloc = os.path.join(dataloc,'EDP2EDP Transport.csv')
-        f = open(csvloc,"r")
-        myreader = csv.reader(f)
+        myreader = iter(rows['EDP2EDP Transport.csv'])
         next(myreader,None)
         for item in myreader:
             if item[0] in self.EDPs and item[1] in self.EDPs:
@@ -521,228 +610,10 @@ class UNWFPModel:
                 for k in self.commodities:
                     self.cost[item[0],item[1],k] = float(item[2])
                     self.dur[item[0],item[1],k] = float(item[3])
-        f.close()
-
-        print "Loading initial inventories..."
-        csvloc = os.path.join(dataloc,'Initial Inventory (DP).csv')
-        f = open(csvloc,"r")
-        myreader = csv.reader(f)
-        next(myreader,None)
-        self.inv = {}
-        for i in (self.DPs+self.EDPs+self.ISs+self.LMs+self.LSs+self.RSs):
-            for k in self.commodities:
-                for t in self.periods:
-                    self.inv[i,k,t] = 0 # Initialising initial inventory for each transshipment node makes the constraints easier to define
-        for item in myreader:
-            if item[0] in self.DPs:
-                i=2
-                for t in self.periods:
-                    if item[i]=="":
-                        self.inv[item[0],item[1],t]=0
-                    else:
-                        self.inv[item[0],item[1],t]=float(item[i])
-                    i+=1
-        f.close()
-        csvloc = os.path.join(dataloc,'Initial Inventory (EDP).csv')
-        f = open(csvloc,"r")
-        myreader = csv.reader(f)
-        next(myreader,None)
-        for item in myreader:
-            if item[0] in self.EDPs:
-                i=2
-                for t in self.periods:
-                    if item[i]=="":
-                        self.inv[item[0],item[1],t]=0
-                    else:
-                        self.inv[item[0],item[1],t]=float(item[i])
-                    i+=1
-        f.close()
-
-        print "Loading additional demands..."
-        csvloc = os.path.join(dataloc,'Activity Rations.csv')
-        f = open(csvloc,"r")
-        myreader = csv.reader(f)
-        next(myreader,None)
-        self.baskets = {}
-        self.feedingdays = {}
-        for b in self.beneficiaries:
-            for k in self.commodities:
-                self.baskets[b,k] = 0 # Initialising for each node makes the constraints easier to define
-                self.feedingdays[b,k] = 0
-            self.baskets[b,"CASH"] = 0
-            self.feedingdays[b,"CASH"] = 0
-        for item in myreader:
-            if item[0] in self.beneficiaries and item[1] in self.commodities:
-                self.baskets[item[0],item[1]] = float(item[2])
-                self.feedingdays[item[0],item[1]] = float(item[3])
-            else:
-                print " > Taxonomy not recognised: ", item
-        f.close()
-        for b in self.beneficiaries:
-            if sum(self.baskets[b,k] for k in self.commodities) + self.baskets[b,"CASH"] == 0:
-                print "<<<WARNING>>> No food basket defined for activity: " + b
-
-        csvloc = os.path.join(dataloc,'Tactical Demand.csv')
-        f = open(csvloc,"r")
-        myreader = csv.reader(f)
-        next(myreader,None)
-        self.tact_demand = {}
-        self.tact_fdp = {}
-        self.tact_com = {}
-        self.tact_mon = {}
-##        for i in self.FDPs:
-##            for t in self.periods:
-##                for k in self.commodities:
-##                    self.tact_demand[i,k,t] = 0 # pre-loading allows for easier constraint definition
-##                self.tact_demand[i,"CASH",t] = 0
-        for item in myreader:
-            i,k,t,d = item[0],item[1],self.xldate2month(float(item[2]),1),float(item[3])
-            if i in self.FDPs and k in self.commodities and t in self.periods:
-                self.tact_demand[i,k,t] = d
-                if i in self.tact_fdp.keys():
-                    self.tact_fdp[i] += d
-                else:
-                    self.tact_fdp[i] = d
-                if k in self.tact_com.keys():
-                    self.tact_com[k] += d
-                else:
-                    self.tact_com[k] = d
-                if t in self.tact_mon.keys():
-                    self.tact_mon[t] += d
-                else:
-                    self.tact_mon[t] = d
-            else:
-                print " > Taxonomy not recognised:  ",i,k,t,d
-        f.close()
-
-        print "Loading forecasts..."
-        csvloc = os.path.join(dataloc,'Price Seasonality.csv')
-        f = open(csvloc,"r")
-        myreader = csv.reader(f)
-        next(myreader,None)
-        self.fc_price={}
-        for item in myreader:
-            self.fc_price[item[0],item[1],"Jan"]=float(item[2])
-            self.fc_price[item[0],item[1],"Feb"]=float(item[3])
-            self.fc_price[item[0],item[1],"Mar"]=float(item[4])
-            self.fc_price[item[0],item[1],"Apr"]=float(item[5])
-            self.fc_price[item[0],item[1],"May"]=float(item[6])
-            self.fc_price[item[0],item[1],"Jun"]=float(item[7])
-            self.fc_price[item[0],item[1],"Jul"]=float(item[8])
-            self.fc_price[item[0],item[1],"Aug"]=float(item[9])
-            self.fc_price[item[0],item[1],"Sep"]=float(item[10])
-            self.fc_price[item[0],item[1],"Oct"]=float(item[11])
-            self.fc_price[item[0],item[1],"Nov"]=float(item[12])
-            self.fc_price[item[0],item[1],"Dec"]=float(item[13])
-        f.close()
-
-        csvloc = os.path.join(dataloc,'Supplier Capacity.csv')
-        f = open(csvloc,"r")
-        myreader = csv.reader(f)
-        next(myreader,None)
-        self.fc_cap={}
-        for item in myreader:
-            self.fc_cap[item[0],item[1],"Jan"]=float(item[2])
-            self.fc_cap[item[0],item[1],"Feb"]=float(item[3])
-            self.fc_cap[item[0],item[1],"Mar"]=float(item[4])
-            self.fc_cap[item[0],item[1],"Apr"]=float(item[5])
-            self.fc_cap[item[0],item[1],"May"]=float(item[6])
-            self.fc_cap[item[0],item[1],"Jun"]=float(item[7])
-            self.fc_cap[item[0],item[1],"Jul"]=float(item[8])
-            self.fc_cap[item[0],item[1],"Aug"]=float(item[9])
-            self.fc_cap[item[0],item[1],"Sep"]=float(item[10])
-            self.fc_cap[item[0],item[1],"Oct"]=float(item[11])
-            self.fc_cap[item[0],item[1],"Nov"]=float(item[12])
-            self.fc_cap[item[0],item[1],"Dec"]=float(item[13])
-        f.close()
 
         print "Creating auxiliary data..."
         # Lead time indicators
-        self.slow = {} # longest duration of reaching an FDP from the key location
-        self.quick = {} # shortest duration of reaching an FDP from the key location
-        for edp in self.EDPs:
-            for fdp in self.FDPs:
-                if (edp,fdp,self.commodities[0]) in self.cost.keys():
-                    self.slow[edp,fdp] = self.dur[edp,fdp,self.commodities[0]]
-                    self.quick[edp,fdp] = self.dur[edp,fdp,self.commodities[0]]
-        for dp in self.DPs:
-            for fdp in self.FDPs:
-                self.slow[dp,fdp] = 0
-                self.quick[dp,fdp] = 999
-                for edp in self.EDPs:
-                    if (edp,fdp) not in self.slow.keys():
-                        continue
-                    if (dp,edp,self.commodities[0]) in self.cost.keys():
-                        ds = self.slow[edp,fdp] + self.dur[dp,edp,self.commodities[0]]
-                        dq = self.quick[edp,fdp] + self.dur[dp,edp,self.commodities[0]]
-                        if ds > self.slow[dp,fdp]:
-                            self.slow[dp,fdp] = ds
-                        if dq < self.quick[dp,fdp]:
-                            self.quick[dp,fdp] = dq
-        for arc in self.proccap.keys(): # arc= (src,ndp,com)
-            for fdp in self.FDPs:
-                if (arc[0],arc[1],fdp) not in self.slow.keys(): # NB: Commodity doesn't matter
-                    self.slow[arc[0],arc[1],fdp] = 0
-                    self.quick[arc[0],arc[1],fdp] = 999
-                    if arc[1] in self.ISs:
-                        for dp in self.DPs:
-                            if (dp,fdp) not in self.slow.keys():
-                                continue
-                            if (arc[1],dp,arc[2]) in self.cost.keys():
-                                ds = self.dur[arc[1],dp,arc[2]] + self.slow[dp,fdp]
-                                dq = self.dur[arc[1],dp,arc[2]] + self.quick[dp,fdp]
-                                if  ds > self.slow[arc[0],arc[1],fdp]:
-                                    self.slow[arc[0],arc[1],fdp] = ds
-                                if  dq < self.quick[arc[0],arc[1],fdp]:
-                                    self.quick[arc[0],arc[1],fdp] = dq
-                    if arc[1] in self.RSs:
-                        for i in (self.DPs+self.EDPs):
-                            if (i,fdp) not in self.slow.keys():
-                                continue
-                            if (arc[1],i,arc[2]) in self.cost.keys():
-                                ds = self.dur[arc[1],i,arc[2]] + self.slow[i,fdp]
-                                dq = self.dur[arc[1],i,arc[2]] + self.quick[i,fdp]
-                                if  ds > self.slow[arc[0],arc[1],fdp]:
-                                    self.slow[arc[0],arc[1],fdp] = ds
-                                if  dq < self.quick[arc[0],arc[1],fdp]:
-                                    self.quick[arc[0],arc[1],fdp] = dq
-                    if arc[1] in self.LSs:
-                        for edp in self.EDPs:
-                            if (edp,fdp) not in self.slow.keys():
-                                continue
-                            if (arc[1],edp,arc[2]) in self.cost.keys():
-                                ds = self.dur[arc[1],edp,arc[2]] + self.slow[edp,fdp]
-                                dq = self.dur[arc[1],edp,arc[2]] + self.quick[edp,fdp]
-                                if  ds > self.slow[arc[0],arc[1],fdp]:
-                                    self.slow[arc[0],arc[1],fdp] = ds
-                                if  dq < self.quick[arc[0],arc[1],fdp]:
-                                    self.quick[arc[0],arc[1],fdp] = dq
-                    if arc[1] in self.LMs:
-                        if (arc[1],fdp,arc[2]) in self.cost.keys():
-                            self.slow[arc[0],arc[1],fdp] = self.dur[arc[1],fdp,arc[2]]
-                            self.quick[arc[0],arc[1],fdp] = self.dur[arc[1],fdp,arc[2]]
-                    if self.quick[arc[0],arc[1],fdp] != 999: # FDP can be reached through this source
-                        self.slow[arc[0],arc[1],fdp] += self.dur[arc]
-                        self.quick[arc[0],arc[1],fdp] += self.dur[arc]
-                    else: # If FDP can't be reached, remove the initialised values (0 for slow, 999 for quick)
-                        self.slow.pop((arc[0],arc[1],fdp),None)
-                        self.quick.pop((arc[0],arc[1],fdp),None)
-                    # NB1: slow[src,ndp,fdp] now captures the duration of supplying the fdp through the slowest route possible
-                    # NB2: quick[src,ndp,fdp] now captures the duration of supplying the fdp through the fastest route possible
-        for key in self.slow.keys():
-            if len(key) < 3:
-                self.slow.pop(key,None)
-                self.quick.pop(key,None)
-                # We only need (src,ndp,fdp)-keys to define the LT measures
-        for key in self.slow.keys(): # Only contains (src,ndp,fdp) keys now
-            if (key[0],key[1]) in self.slow.keys():
-                continue
-            self.slow[key[0],key[1]] = max(self.slow[key[0],key[1],fdp] for fdp in self.FDPs if (key[0],key[1],fdp) in self.slow.keys())
-            self.quick[key[0],key[1]] = max(self.quick[key[0],key[1],fdp] for fdp in self.FDPs if (key[0],key[1],fdp) in self.slow.keys())
-        for key in self.slow.keys():
-            if len(key) == 3:
-                self.slow.pop(key,None)
-                self.quick.pop(key,None)
+        self.calc_leadtimes()
 
         # Location type classification
         self.type = {}
@@ -849,58 +720,301 @@ class UNWFPModel:
         # Create indices for commodities and locations
         self.comindex = range(len(self.commodities))
 
-        # Store variables for later use
-        print "Storing data inputs..."
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        dest_dir = os.path.join(script_dir, 'data')
-        path = os.path.join(dest_dir, 'data.pickle')
-        f = open(path,'wb')
-        pickle.dump(vars(self),f)
-        f.close()
-        # Ticking the box
-        path = os.path.join(dest_dir, 'check.csv')
-        out = open(path,"wb")
-        c = csv.writer(out, dialect='excel')
-        c.writerow([1])
-        out.close()
+    def calc_leadtimes(self):
+        '''
+        Calculate the lead time indicators of each procurement option (src, ndp):
+        self.slow[src,ndp] = longest duration of reaching the furthest FDP from the source
+        self.quick[src,ndp] = shortest duration of reaching the furthest FDP from the source
+        The network is processed backwards (FDP <- EDP <- DP <- NDP) and the durations are stored per node, so every route is only visited once
+        '''
+
+        com0 = self.commodities[0] # Downstream routes are the same for each commodity
+        FDPset = set(self.FDPs)
+        DPset = set(self.DPs)
+        EDPset = set(self.EDPs)
+        out = {} # (location, com) -> destinations
+        for key in self.cost.keys():
+            out.setdefault((key[0],key[2]),[]).append(key[1])
+        # Downstream: down[i][fdp] = [slowest, quickest] duration of reaching the fdp from DP/EDP i
+        down = {}
+        for edp in self.EDPs:
+            down[edp] = {}
+            for fdp in out.get((edp,com0),[]):
+                if fdp in FDPset:
+                    down[edp][fdp] = [self.dur[edp,fdp,com0],self.dur[edp,fdp,com0]]
+        for dp in self.DPs:
+            down[dp] = {}
+            for fdp in self.FDPs:
+                down[dp][fdp] = [0,999]
+            for edp in out.get((dp,com0),[]):
+                if edp not in EDPset:
+                    continue
+                d = self.dur[dp,edp,com0]
+                for fdp in down[edp].keys():
+                    ds = down[edp][fdp][0] + d
+                    dq = down[edp][fdp][1] + d
+                    if ds > down[dp][fdp][0]:
+                        down[dp][fdp][0] = ds
+                    if dq < down[dp][fdp][1]:
+                        down[dp][fdp][1] = dq
+        # Upstream: the durations from each ndp (per commodity, because shipping routes differ by commodity)
+        up = {}
+        lt = {} # (src,ndp) -> {fdp: [slowest, quickest]}
+        for arc in self.proccap.keys(): # arc= (src,ndp,com)
+            if (arc[1],arc[2]) not in up:
+                up[arc[1],arc[2]] = self.ndp_leadtimes(arc[1],arc[2],out,down,FDPset,DPset,EDPset)
+            if (arc[0],arc[1]) not in lt:
+                lt[arc[0],arc[1]] = {}
+            for fdp in up[arc[1],arc[2]].keys():
+                if fdp not in lt[arc[0],arc[1]]: # NB: Commodity doesn't matter; the first commodity that reaches the FDP is used
+                    lt[arc[0],arc[1]][fdp] = [up[arc[1],arc[2]][fdp][0] + self.dur[arc],up[arc[1],arc[2]][fdp][1] + self.dur[arc]]
+        # We only need (src,ndp)-keys to define the LT measures
+        self.slow = {}
+        self.quick = {}
+        for key in lt.keys():
+            if lt[key] != {}:
+                self.slow[key] = max(lt[key][fdp][0] for fdp in lt[key].keys())
+                self.quick[key] = max(lt[key][fdp][1] for fdp in lt[key].keys())
+
+    def ndp_leadtimes(self,ndp,com,out,down,FDPset,DPset,EDPset):
+        '''
+        Returns {fdp: [slowest, quickest]} duration of reaching each FDP from the ndp (excluding the procurement lead time)
+        FDPs that can't be reached are left out
+        '''
+
+        dests = out.get((ndp,com),[])
+        res = {}
+        for fdp in self.FDPs:
+            res[fdp] = [0,999]
+        valid = [] # Downstream nodes that can be reached from the ndp
+        if ndp in self.ISs:
+            valid += [i for i in dests if i in DPset]
+        if ndp in self.RSs:
+            valid += [i for i in dests if i in DPset or i in EDPset]
+        if ndp in self.LSs:
+            valid += [i for i in dests if i in EDPset]
+        for i in valid:
+            d = self.dur[ndp,i,com]
+            for fdp in down[i].keys():
+                ds = d + down[i][fdp][0]
+                dq = d + down[i][fdp][1]
+                if ds > res[fdp][0]:
+                    res[fdp][0] = ds
+                if dq < res[fdp][1]:
+                    res[fdp][1] = dq
+        if ndp in self.LMs:
+            for fdp in dests:
+                if fdp in FDPset:
+                    res[fdp] = [self.dur[ndp,fdp,com],self.dur[ndp,fdp,com]]
+        for fdp in res.keys():
+            if res[fdp][1] == 999: # FDP can't be reached through this ndp
+                res.pop(fdp,None)
+        return res
+
+    def load_support(self,rows):
+        '''
+        Load the support cost rates
+        '''
+
+        print "Loading support costs..."
+        myreader = iter(rows['Support Costs.csv'])
+        next(myreader,None)
+        self.odocF = float(next(myreader,None)[1])
+        self.odocCV = float(next(myreader,None)[1])
+        self.dsc = float(next(myreader,None)[1])
+        self.isc = float(next(myreader,None)[1])
+        self.ltsh = float(next(myreader,None)[1])
+
+    def load_inventories(self,rows):
+        '''
+        Load the initial inventories at the DPs and EDPs
+        '''
+
+        print "Loading initial inventories..."
+        myreader = iter(rows['Initial Inventory (DP).csv'])
+        next(myreader,None)
+        self.inv = {}
+        for i in (self.DPs+self.EDPs+self.ISs+self.LMs+self.LSs+self.RSs):
+            for k in self.commodities:
+                for t in self.periods:
+                    self.inv[i,k,t] = 0 # Initialising initial inventory for each transshipment node makes the constraints easier to define
+        for item in myreader:
+            if item[0] in self.DPs:
+                i=2
+                for t in self.periods:
+                    if item[i]=="":
+                        self.inv[item[0],item[1],t]=0
+                    else:
+                        self.inv[item[0],item[1],t]=float(item[i])
+                    i+=1
+        myreader = iter(rows['Initial Inventory (EDP).csv'])
+        next(myreader,None)
+        for item in myreader:
+            if item[0] in self.EDPs:
+                i=2
+                for t in self.periods:
+                    if item[i]=="":
+                        self.inv[item[0],item[1],t]=0
+                    else:
+                        self.inv[item[0],item[1],t]=float(item[i])
+                    i+=1
+
+    def load_demands(self,rows):
+        '''
+        Load the activity rations and tactical demand
+        '''
+
+        print "Loading additional demands..."
+        myreader = iter(rows['Activity Rations.csv'])
+        next(myreader,None)
+        self.baskets = {}
+        self.feedingdays = {}
+        for b in self.beneficiaries:
+            for k in self.commodities:
+                self.baskets[b,k] = 0 # Initialising for each node makes the constraints easier to define
+                self.feedingdays[b,k] = 0
+            self.baskets[b,"CASH"] = 0
+            self.feedingdays[b,"CASH"] = 0
+        for item in myreader:
+            if item[0] in self.beneficiaries and item[1] in self.commodities:
+                self.baskets[item[0],item[1]] = float(item[2])
+                self.feedingdays[item[0],item[1]] = float(item[3])
+            else:
+                print " > Taxonomy not recognised: ", item
+        for b in self.beneficiaries:
+            if sum(self.baskets[b,k] for k in self.commodities) + self.baskets[b,"CASH"] == 0:
+                print "<<<WARNING>>> No food basket defined for activity: " + b
+
+        myreader = iter(rows['Tactical Demand.csv'])
+        next(myreader,None)
+        self.tact_demand = {}
+        self.tact_fdp = {}
+        self.tact_com = {}
+        self.tact_mon = {}
+##        for i in self.FDPs:
+##            for t in self.periods:
+##                for k in self.commodities:
+##                    self.tact_demand[i,k,t] = 0 # pre-loading allows for easier constraint definition
+##                self.tact_demand[i,"CASH",t] = 0
+        items = list(myreader)
+        months = self.xldates2months([float(item[2]) for item in items],1)
+        for item,t in zip(items,months):
+            i,k,d = item[0],item[1],float(item[3])
+            if i in self.FDPs and k in self.commodities and t in self.periods:
+                self.tact_demand[i,k,t] = d
+                if i in self.tact_fdp.keys():
+                    self.tact_fdp[i] += d
+                else:
+                    self.tact_fdp[i] = d
+                if k in self.tact_com.keys():
+                    self.tact_com[k] += d
+                else:
+                    self.tact_com[k] = d
+                if t in self.tact_mon.keys():
+                    self.tact_mon[t] += d
+                else:
+                    self.tact_mon[t] = d
+            else:
+                print " > Taxonomy not recognised:  ",i,k,t,d
+
+    def load_forecasts(self,rows):
+        '''
+        Load the price seasonality and supplier capacity forecasts
+        '''
+
+        print "Loading forecasts..."
+        myreader = iter(rows['Price Seasonality.csv'])
+        next(myreader,None)
+        self.fc_price={}
+        for item in myreader:
+            self.fc_price[item[0],item[1],"Jan"]=float(item[2])
+            self.fc_price[item[0],item[1],"Feb"]=float(item[3])
+            self.fc_price[item[0],item[1],"Mar"]=float(item[4])
+            self.fc_price[item[0],item[1],"Apr"]=float(item[5])
+            self.fc_price[item[0],item[1],"May"]=float(item[6])
+            self.fc_price[item[0],item[1],"Jun"]=float(item[7])
+            self.fc_price[item[0],item[1],"Jul"]=float(item[8])
+            self.fc_price[item[0],item[1],"Aug"]=float(item[9])
+            self.fc_price[item[0],item[1],"Sep"]=float(item[10])
+            self.fc_price[item[0],item[1],"Oct"]=float(item[11])
+            self.fc_price[item[0],item[1],"Nov"]=float(item[12])
+            self.fc_price[item[0],item[1],"Dec"]=float(item[13])
+
+        myreader = iter(rows['Supplier Capacity.csv'])
+        next(myreader,None)
+        self.fc_cap={}
+        for item in myreader:
+            self.fc_cap[item[0],item[1],"Jan"]=float(item[2])
+            self.fc_cap[item[0],item[1],"Feb"]=float(item[3])
+            self.fc_cap[item[0],item[1],"Mar"]=float(item[4])
+            self.fc_cap[item[0],item[1],"Apr"]=float(item[5])
+            self.fc_cap[item[0],item[1],"May"]=float(item[6])
+            self.fc_cap[item[0],item[1],"Jun"]=float(item[7])
+            self.fc_cap[item[0],item[1],"Jul"]=float(item[8])
+            self.fc_cap[item[0],item[1],"Aug"]=float(item[9])
+            self.fc_cap[item[0],item[1],"Sep"]=float(item[10])
+            self.fc_cap[item[0],item[1],"Oct"]=float(item[11])
+            self.fc_cap[item[0],item[1],"Nov"]=float(item[12])
+            self.fc_cap[item[0],item[1],"Dec"]=float(item[13])
+        # Index the procurement arcs by origin country, so that the supplier capacity constraints don't have to scan all arcs (see prep_network(self))
+        self.fc_arcs = {} # (origin country, com) -> procurement arcs (src, ndp, com)
+        countries = set([key[0] for key in self.fc_cap.keys()])
+        origin = {} # src -> origin countries it belongs to
+        for arc in self.cost.keys():
+            if arc[0] not in origin:
+                origin[arc[0]] = [ctry for ctry in countries if arc[0].startswith(ctry)]
+            for ctry in origin[arc[0]]:
+                self.fc_arcs.setdefault((ctry,arc[2]),[]).append(arc)
 
     def load_quick(self):
         '''
         Load data from previous session.
         There's no need to reprocess the data if nothing changed
+        Raises a ValueError if the data was stored by a different version of AID-M
         '''
 
         script_dir = os.path.dirname(os.path.abspath(__file__))
         dest_dir = os.path.join(script_dir, 'data')
         path = os.path.join(dest_dir, 'data.pickle')
         f = open(path,'rb')
-        M = pickle.load(f)
+        try:
+            version = pickle.load(f)
+            if version != self.DATA_VERSION:
+                raise ValueError("Stored data has version " + str(version) + " instead of " + str(self.DATA_VERSION))
+            M = pickle.load(f)
+        finally:
+            f.close()
         for var in M.items():
             setattr(self, var[0], var[1])
-        f.close()
 
     def prep(self):
         '''
         Setup the mathematical model by preparing all the constraints and variables that will not change between scenarios.
         Doing so saves a lot of time when analysing multiple scenarios.
         Depending on the size of the problem, this may save anything from 3 seconds to several minutes per scenario.
+        The model is built once for all periods (see prep_network(self)), and then sliced to the time horizon (see prep_window(self)),
+        so changing only the time horizon doesn't require rebuilding the model.
         '''
 
         print "Preparing the model:"
         self.genstart = time.time()
+        if not self.prepped or self.network != self.network_key():
+            self.prep_network()
+        self.prep_window()
+        self.gendur = time.time()-self.genstart
+        print "Finished preparing the model:"
+        print str(self.n_vars)+" Variables & "+str(len(self.CORE))+" Constraints in "+str(self.gendur)+" seconds"
+        print "(" + str(self.pruned) + " of " + str(len(self.arcs)) + " flows pruned from the space-time network)"
+        print " "
+        self.prepped = self.prep_key() # Tracks whether the data has been set up yet
+
+    def prep_network(self):
+        '''
+        Builds the space-time network, decision variables, statistics (per period) and general constraints for all periods in self.periods.
+        Each general constraint is tagged with the period it belongs to, so that prep_window(self) can select the ones within the time horizon.
+        '''
 
-        # Create the subset of self.periods in which we are allowed to make decisions
         self.horizon = list(self.periods)
-        for t in self.periods:
-            if t != self.tstart.get():
-                self.horizon.remove(t)
-            else:
-                break
-        for t in reversed(self.periods):
-            if t != self.tend.get():
-                self.horizon.remove(t)
-            else:
-                break
         self.hor = range(len(self.horizon)) # This list contains indices to self.horizon rather than month names
 
         print "Creating space-time network..."
@@ -910,16 +1024,16 @@ class UNWFPModel:
             for t in self.hor:
                 self.arcs[arc[0],arc[1],arc[2],t] = self.cost[arc]
 
-        self.frame_right.update_idletasks()
+        self.update_idle()
 
         # Overwrite prices with forecasts if available
         if self.useforecasts.get()==1:
             # Int'l forecast
             for key in self.proccap.keys(): # key = (src, ndp, com)
                 ctry = key[0][:-6]
-                if key not in self.date.keys():
+                if key not in self.date:
                     continue
-                if (ctry,key[2],self.date[key]) in self.fc_price.keys():
+                if (ctry,key[2],self.date[key]) in self.fc_price:
                     for t in self.hor:
                         mon1 = self.horizon[t][0:3]
                         self.arcs[key[0],key[1],key[2],t] = self.cost[key] / self.fc_price[ctry,key[2],self.date[key]] * self.fc_price[ctry,key[2],mon1]
@@ -927,7 +1041,7 @@ class UNWFPModel:
             # CBT forecast
             for m in self.LMs:
                 for k in self.commodities:
-                    if (m,k,"Jan") in self.fc_price.keys():
+                    if (m,k,"Jan") in self.fc_price:
                         for t in self.hor:
                             mon1 = self.horizon[t][0:3]
                             self.arcs['Local Markets - C&V',m,k,t] = self.fc_price[m,k,mon1]
@@ -967,10 +1081,32 @@ class UNWFPModel:
                     self.arr[key[1],key[2],t].append([key[0],key[1],key[2],t])
         # NB 1 : the dictionary self.arr[i,k,t] now captures all k flowing into i at time t    (excluding the inv[i,k,t] from the data)
         # NB 2 : the corresponding outflow is captured by the [i,j,k,t] keys from self.arc
-
-
+        outarcs = {} # location -> arcs leaving the location
+        inarcs = {} # location -> arcs arriving in the location
+        outcom = {} # (location, com) -> arcs leaving the location with the commodity
+        self.fdp_arcs = {} # (FDP, com) -> arcs delivering the commodity to the FDP (see calculate(self, NAME))
+        self.route_index = ArcIndex(["origin","dest","com"]) # used by the routing and capacity allocation rules (see calculate(self, NAME))
+        for arc in self.cost.keys():
+            outarcs.setdefault(arc[0],[]).append(arc)
+            inarcs.setdefault(arc[1],[]).append(arc)
+            outcom.setdefault((arc[0],arc[2]),[]).append(arc)
+            if arc[1] in self.FDPs:
+                self.fdp_arcs.setdefault((arc[1],arc[2]),[]).append(arc)
+            self.route_index.add(arc, arc)
+        self.proc_index = ArcIndex(["country","inco","ndp","com"]) # used by the procurement and C&V rules (see calculate(self, NAME))
+        for arc in self.proccap.keys():
+            self.proc_index.add(arc, [arc[0][:-6], arc[0][-3:], arc[1], arc[2]]) # NB: sources are named "country - incoterm"
+        live = self.live_arcs(outcom)
+
+
+        tick = self.record("Prep: Space-time network",self.genstart)
         print "Creating decision variables..."
-        self.F = LpVariable.dicts('Flow',self.arcs,0,None,LpContinuous) # Note that variables are created 'sparse', i.e. only relevant arcs are included
+        self.F = LpVariable.dicts('Flow',[arc for arc in self.arcs if arc in live],0,None,LpContinuous) # Note that variables are created 'sparse', i.e. only relevant arcs are included
+        self.NoFlow = LpVariable("NoFlow",0,0,LpContinuous) # Shared by all arcs that were pruned from the network (fixed at 0)
+        self.NoFlow.varValue = 0 # NB: also when it doesn't end up in the LP
+        for arc in self.arcs:
+            if arc not in live:
+                self.F[arc] = self.NoFlow
         self.R = LpVariable.dicts('Ration',(self.commodities,self.hor),0,None,LpContinuous)
         self.CV = LpVariable.dicts("C&V",(self.FDPs,self.hor),0,None,LpContinuous) # Cash & Voucher component of the basket
         self.K = LpVariable.dicts("Commodity",(self.commodities,self.hor),0,1,LpBinary) # Auxiliary variable
@@ -982,70 +1118,58 @@ class UNWFPModel:
         self.P = LpVariable.dicts("Procured",(self.slow,self.hor),0,1,LpBinary) # Auxiliary variable
         self.LT = LpVariable.dicts("LeadTime",self.hor,0,None,LpContinuous) # Auxiliary variable
         self.LTmax = LpVariable("LTmax",0,None,LpContinuous)
-        self.stats["Lead Time"] =self.LT # initialised as LTsum, but LT makes more sense to track
 
+        tick = self.record("Prep: Decision variables",tick)
         print "Creating statistics..."
+        for name in self.STATISTICS:
+            setattr(self,name,getattr(self,name,{})) # NB: most statistics are referred to by self.stats, so they are refilled rather than replaced
+            getattr(self,name).clear()
+        # Index the arcs once, so that each statistic is built from the relevant arcs only (rather than scanning all arcs for every period and node)
+        srcset = set(self.sources)
+        ISset, RSset, LSset, LMset = set(self.ISs), set(self.RSs), set(self.LSs), set(self.LMs)
+        DPset, EDPset, FDPset = set(self.DPs), set(self.EDPs), set(self.FDPs)
+        procarcs = {} # t -> procurement arcs (with their price in period t)
+        for t in self.hor:
+            procarcs[t] = []
+        for proc in self.arcs.items():
+            if proc[0][0] in srcset:
+                procarcs[proc[0][3]].append(proc)
         # Procurement Costs
         for t in self.hor:
-            self.PC_I[t] = lpSum([self.F[proc[0]]*proc[1] for proc in self.arcs.items() if proc[0][0] in self.sources and proc[0][1] in self.ISs and proc[0][3]==t]) # Procurement costs (int)
-            self.PC_L[t] = lpSum([self.mod_loc * self.F[proc[0]]*proc[1] for proc in self.arcs.items() if proc[0][0] in self.sources and proc[0][1] in self.LSs and proc[0][3]==t]) # Procurement costs (loc)
-            self.PC_CV[t] = lpSum([self.mod_cbt * self.F[proc[0]]*proc[1] for proc in self.arcs.items() if proc[0][0] in self.sources and proc[0][1] in self.LMs and proc[0][3]==t]) # Procurement costs (C&V)
-            self.PC_R[t] = lpSum([self.mod_reg * self.F[proc[0]]*proc[1] for proc in self.arcs.items() if proc[0][0] in self.sources and proc[0][1] in self.RSs and proc[0][3]==t]) # Procurement costs (reg)
+            self.PC_I[t] = self.linsum((self.F[proc[0]],proc[1]) for proc in procarcs[t] if proc[0][1] in ISset) # Procurement costs (int)
+            self.PC_L[t] = self.linsum((self.F[proc[0]],self.mod_loc*proc[1]) for proc in procarcs[t] if proc[0][1] in LSset) # Procurement costs (loc)
+            self.PC_CV[t] = self.linsum((self.F[proc[0]],self.mod_cbt*proc[1]) for proc in procarcs[t] if proc[0][1] in LMset) # Procurement costs (C&V)
+            self.PC_R[t] = self.linsum((self.F[proc[0]],self.mod_reg*proc[1]) for proc in procarcs[t] if proc[0][1] in RSset) # Procurement costs (reg)
             self.PC[t] = self.PC_I[t] + self.PC_L[t] + self.PC_CV[t] + self.PC_R[t] # Total procurement costs
             # NB: We look at self.arcs.items() because procurement prices may differ between periods (forecast)
-        self.PC_I["Total"] = sum(self.PC_I[t] for t in self.hor)
-        self.PC_I["Average"] = self.PC_I["Total"]/float(len(self.hor))
-        self.PC_L["Total"] = sum(self.PC_L[t] for t in self.hor)
-        self.PC_L["Average"] = self.PC_L["Total"]/float(len(self.hor))
-        self.PC_CV["Total"] = sum(self.PC_CV[t] for t in self.hor)
-        self.PC_CV["Average"] = self.PC_CV["Total"]/float(len(self.hor))
-        self.PC_R["Total"] = sum(self.PC_R[t] for t in self.hor)
-        self.PC_R["Average"] = self.PC_R["Total"]/float(len(self.hor))
-        self.PC["Total"] = sum(self.PC[t] for t in self.hor)
-        self.PC["Average"] = self.PC["Total"]/float(len(self.hor))
         # TRansportation costs
+        ocean = [arc for arc in self.cost.keys() if arc[0] not in srcset and arc[1] in DPset]
+        overland = [arc for arc in self.cost.keys() if arc[0] in RSset and arc[1] in EDPset]
+        inland = [arc for arc in self.cost.keys() if ((arc[0] not in RSset and arc[1] in EDPset) or arc[1] in FDPset)]
         for t in self.hor:
-            self.TR_OC[t] = lpSum([self.F[arc[0],arc[1],arc[2],t]*self.cost[arc] for arc in self.cost.keys() if arc[0] not in self.sources and arc[1] in self.DPs]) # OCean costs
-            self.TR_OL[t] = lpSum([self.F[arc[0],arc[1],arc[2],t]*self.cost[arc] for arc in self.cost.keys() if arc[0] in self.RSs and arc[1] in self.EDPs]) # OverLand costs
-            self.TR_IL[t] = lpSum([self.F[arc[0],arc[1],arc[2],t]*self.cost[arc] for arc in self.cost.keys() if ((arc[0] not in self.RSs and arc[1] in self.EDPs) or arc[1] in self.FDPs)]) # InLand costs
+            self.TR_OC[t] = self.linsum((self.F[arc[0],arc[1],arc[2],t],self.cost[arc]) for arc in ocean) # OCean costs
+            self.TR_OL[t] = self.linsum((self.F[arc[0],arc[1],arc[2],t],self.cost[arc]) for arc in overland) # OverLand costs
+            self.TR_IL[t] = self.linsum((self.F[arc[0],arc[1],arc[2],t],self.cost[arc]) for arc in inland) # InLand costs
             self.TR[t] = self.TR_OC[t] + self.TR_OL[t] + self.TR_IL[t] # Total transportation costs
             # NB: We look at self.cost.keys() rather than self.arc.items() because the transportation cost doesn't change over time - this saves a lot of computation time
-        self.TR_OC["Total"] = sum(self.TR_OC[t] for t in self.hor)
-        self.TR_OC["Average"] = self.TR_OC["Total"]/float(len(self.hor))
-        self.TR_OL["Total"] = sum(self.TR_OL[t] for t in self.hor)
-        self.TR_OL["Average"] = self.TR_OL["Total"]/float(len(self.hor))
-        self.TR_IL["Total"] = sum(self.TR_IL[t] for t in self.hor)
-        self.TR_IL["Average"] = self.TR_IL["Total"]/float(len(self.hor))
-        self.TR["Total"] = sum(self.TR[t] for t in self.hor)
-        self.TR["Average"] = self.TR["Total"]/float(len(self.hor))
         # Handling Costs
-        self.LOAD = {}
-        self.LOAD_F = {}
-        self.LOAD_CV = {}
         for t in self.hor:
             for i in (self.DPs+self.EDPs):
-                self.LOAD[i,t] = lpSum(self.F[arc[0],arc[1],arc[2],t] for arc in self.cost.keys() if arc[0]==i) + lpSum(self.F[i,i,k,t] for k in self.commodities) # Flow originating from transshipment point i
-                self.HC[i,t] = lpSum(self.F[arc[0],arc[1],arc[2],t]*self.hc[i] for arc in self.cost.keys() if arc[0]==i) + lpSum(self.F[i,i,k,t]*self.sc[i] for k in self.commodities)
+                self.LOAD[i,t] = self.linsum(chain(((self.F[arc[0],arc[1],arc[2],t],1) for arc in outarcs.get(i,[])),((self.F[i,i,k,t],1) for k in self.commodities))) # Flow originating from transshipment point i
+                self.HC[i,t] = self.linsum(chain(((self.F[arc[0],arc[1],arc[2],t],self.hc[i]) for arc in outarcs.get(i,[])),((self.F[i,i,k,t],self.sc[i]) for k in self.commodities)))
                 # NB: capturing flows arriving in an (E)DP is messy due to lead times, but we know that outflow[t] = inflow[t]
             for i in (self.FDPs):
-                self.LOAD_F[i,t] = lpSum(self.F[arc[0],arc[1],arc[2],t] for arc in self.cost.keys() if arc[1]==i and arc[0] not in self.LMs) # Flow (non-C&V) arriving in fdp i
-                self.LOAD_CV[i,t] = lpSum(self.F[arc[0],arc[1],arc[2],t] for arc in self.cost.keys() if arc[1]==i and arc[0] in self.LMs) # Flow (C&V) arriving in fdp i
+                self.LOAD_F[i,t] = self.linsum((self.F[arc[0],arc[1],arc[2],t],1) for arc in inarcs.get(i,[]) if arc[0] not in LMset) # Flow (non-C&V) arriving in fdp i
+                self.LOAD_CV[i,t] = self.linsum((self.F[arc[0],arc[1],arc[2],t],1) for arc in inarcs.get(i,[]) if arc[0] in LMset) # Flow (C&V) arriving in fdp i
                 self.LOAD[i,t] = self.LOAD_F[i,t] + self.LOAD_CV[i,t]
                 self.HC[i,t] = self.hc[i]*self.LOAD_F[i,t] # Distribution costs are not incurred for C&V
-            self.HC[t] = sum(self.HC[i,t] for i in (self.DPs+self.EDPs+self.FDPs))
-        self.HC["Total"] = sum(self.HC[t] for t in self.hor)
-        self.HC["Average"] = self.HC["Total"]/float(len(self.hor))
+            self.HC[t] = lpSum(self.HC[i,t] for i in (self.DPs+self.EDPs+self.FDPs))
         # ODOC costs
+        food = [arc for arc in self.cost.keys() if arc[0] in srcset and arc[1] not in LMset]
         for t in self.hor:
-            self.ODOC_F[t] = lpSum([self.F[arc[0],arc[1],arc[2],t]*self.odocF for arc in self.cost.keys() if arc[0] in self.sources and arc[1] not in self.LMs]) # ODOC costs (food)
+            self.ODOC_F[t] = self.linsum((self.F[arc[0],arc[1],arc[2],t],self.odocF) for arc in food) # ODOC costs (food)
             self.ODOC_CV[t] = self.PC_CV[t] * self.odocCV # ODOC costs (C&V)
             self.ODOC[t] = self.ODOC_F[t] + self.ODOC_CV[t]
-        self.ODOC_CV["Total"] = sum(self.ODOC_CV[t] for t in self.hor)
-        self.ODOC_CV["Average"] = self.ODOC_CV["Total"]/float(len(self.hor))
-        self.ODOC_F["Total"] = sum(self.ODOC_F[t] for t in self.hor)
-        self.ODOC_F["Average"] = self.ODOC_F["Total"]/float(len(self.hor))
-        self.ODOC["Total"] = sum(self.ODOC[t] for t in self.hor)
-        self.ODOC["Average"] = self.ODOC["Total"]/float(len(self.hor))
         # Total Costs
         for t in self.hor:
             self.DOC[t] = self.PC[t] + self.TR[t] + self.HC[t] + self.ODOC[t] # Direct Operational Costs
@@ -1053,17 +1177,11 @@ class UNWFPModel:
             self.TDC[t] = self.DOC[t] + self.DSC[t] # Total Direct Costs
             self.ISC[t] = self.TDC[t]*self.isc # Indirect Support Costs
             self.TC[t] = self.TDC[t] + self.ISC[t] # Total Costs of the operation
-        self.DOC["Total"] = sum(self.DOC[t] for t in self.hor)
-        self.DOC["Average"] = self.DOC["Total"]/float(len(self.hor))
-        self.DSC["Total"] = sum(self.DSC[t] for t in self.hor)
-        self.DSC["Average"] = self.DSC["Total"]/float(len(self.hor))
-        self.TDC["Total"] = sum(self.TDC[t] for t in self.hor)
-        self.TDC["Average"] = self.TDC["Total"]/float(len(self.hor))
-        self.ISC["Total"] = sum(self.ISC[t] for t in self.hor)
-        self.ISC["Average"] = self.ISC["Total"]/float(len(self.hor))
-        self.TC["Total"] = sum(self.TC[t] for t in self.hor)
-        self.TC["Average"] = self.TC["Total"]/float(len(self.hor))
         # Other statistics
+        proc_I = [arc for arc in self.proccap.keys() if arc[1] in ISset]
+        proc_R = [arc for arc in self.proccap.keys() if arc[1] in RSset]
+        proc_L = [arc for arc in self.proccap.keys() if arc[1] in LSset]
+        proc_CV = [arc for arc in self.proccap.keys() if arc[1] in LMset]
         for t in self.hor:
             self.NVS[t] = len(self.nutrients)+lpSum(self.S[l][t]*-1 for l in self.nutrients) # Nutritional Value Score
             self.COMS[t] = lpSum(self.K[k][t] for k in self.commodities) # Amount of unique commodities
@@ -1072,142 +1190,533 @@ class UNWFPModel:
             self.KCAL[t] = lpSum([float(self.nutval[k,"ENERGY (kcal)"])/100*self.R[k][t] for k in self.commodities]) # Amount of kcal supplied per beneficiary
             self.PROT[t] = lpSum([4.1*float(self.nutval[k,"PROTEIN (g)"])/100*self.R[k][t] for k in self.commodities]) # Amount of kcal supplied through proteins
             self.FAT[t] = lpSum([8.8*float(self.nutval[k,"FAT    (g)"])/100*self.R[k][t] for k in self.commodities]) # Amount of kcal supplied through fats
-            self.MT_I[t] = lpSum(self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[1] in self.ISs) # Total amount of mt purchased (int)
-            self.MT_R[t] = lpSum(self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[1] in self.RSs) # Total amount of mt purchased (reg)
-            self.MT_L[t] = lpSum(self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[1] in self.LSs) # Total amount of mt purchased (loc)
-            self.MT_CV[t] = lpSum(self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[1] in self.LMs) # Total amount of mt purchased (c&v)
+            self.MT_I[t] = self.linsum((self.F[arc[0],arc[1],arc[2],t],1) for arc in proc_I) # Total amount of mt purchased (int)
+            self.MT_R[t] = self.linsum((self.F[arc[0],arc[1],arc[2],t],1) for arc in proc_R) # Total amount of mt purchased (reg)
+            self.MT_L[t] = self.linsum((self.F[arc[0],arc[1],arc[2],t],1) for arc in proc_L) # Total amount of mt purchased (loc)
+            self.MT_CV[t] = self.linsum((self.F[arc[0],arc[1],arc[2],t],1) for arc in proc_CV) # Total amount of mt purchased (c&v)
             self.MT[t] = self.MT_I[t] + self.MT_R[t] + self.MT_L[t] + self.MT_CV[t] # Total amount of mt purchased
-            self.LTsum[t] = lpSum(self.F[arc[0],arc[1],arc[2],t]*self.dur[arc] for arc in self.cost.keys()) # Sum of lead times    NB: Has to be divided by MT[t] to get the average lead time
+            self.LTsum[t] = self.linsum((self.F[arc[0],arc[1],arc[2],t],self.dur[arc]) for arc in self.cost.keys()) # Sum of lead times    NB: Has to be divided by MT[t] to get the average lead time
         # Could add weighted functions, minimum NVS, avg NVS, discounts, etc.??
-        self.NVS["Total"] = sum(self.NVS[t] for t in self.hor)
-        self.COMS["Total"] = sum(self.COMS[t] for t in self.hor)
-        self.GROUPS["Total"] = sum(self.GROUPS[t] for t in self.hor)
-        self.FCS["Total"] = sum(self.FCS[t] for t in self.hor)
-        self.KCAL["Total"] = sum(self.KCAL[t] for t in self.hor)
-        self.PROT["Total"] = sum(self.PROT[t] for t in self.hor)
-        self.FAT["Total"] = sum(self.FAT[t] for t in self.hor)
-        self.MT_I["Total"] = sum(self.MT_I[t] for t in self.hor)
-        self.MT_I["Average"] = self.MT_I["Total"]/float(len(self.hor))
-        self.MT_R["Total"] = sum(self.MT_R[t] for t in self.hor)
-        self.MT_R["Average"] = self.MT_R["Total"]/float(len(self.hor))
-        self.MT_L["Total"] = sum(self.MT_L[t] for t in self.hor)
-        self.MT_L["Average"] = self.MT_L["Total"]/float(len(self.hor))
-        self.MT_CV["Total"] = sum(self.MT_CV[t] for t in self.hor)
-        self.MT_CV["Average"] = self.MT_CV["Total"]/float(len(self.hor))
-        self.MT["Total"] = sum(self.MT[t] for t in self.hor)
-        self.MT["Average"] = self.MT["Total"]/float(len(self.hor))
-        self.LTsum["Total"] = sum(self.LTsum[t] for t in self.hor)
-        self.LTsum["Average"] = self.LTsum["Total"]/float(len(self.hor))
 
+        tick = self.record("Prep: Statistics",tick)
+        print "Tightening big-M constraints..."
+        self.presolve()
+        tick = self.record("Prep: Big-M presolve",tick,self.bigm_note())
         print "Creating model constraints..."
-        self.CORE = {} # Used to store general constraints
-        count = 0
+        M = SparseRows(self.NoFlow) # The general constraints are assembled as a sparse matrix, and only turned into PuLP constraints at the end
 
         # Lead time tracking
+        procs = {} # (src, ndp) -> commodities
         for key in self.proccap.keys(): # key = (src, ndp, com)
+            procs.setdefault((key[0],key[1]),[]).append(key[2])
+        for key in procs.keys(): # NB: P and quick don't depend on the commodity, so one set of rows per (src, ndp) suffices
             for t in self.hor:
-                self.CORE[count]= self.F[key[0],key[1],key[2],t] <= 1000000000 * self.P[key[0],key[1]][t]
-                self.CORE[count+1]= self.LT[t] >= self.P[key[0],key[1]][t] * self.quick[key[0],key[1]]
-                count+=2
+                if (key[0],key[1],t) in self.Pmax:
+                    M.add([(self.F[key[0],key[1],k,t],1) for k in procs[key]] + [(self.P[key[0],key[1]][t],-self.Pmax[key[0],key[1],t])], LpConstraintLE, tag=t)
+                M.add([(self.LT[t],1), (self.P[key[0],key[1]][t],-self.quick[key[0],key[1]])], LpConstraintGE, tag=t)
         for t in self.hor:
-            self.CORE[count]= self.LTmax >= self.LT[t]
-            count+=1
+            M.add([(self.LTmax,1), (self.LT[t],-1)], LpConstraintGE, tag=t)
 
         # Shortfall tracking
         for t in self.hor:
             for l in self.nutrients:
-                self.CORE[count] = self.S[l][t] <= self.SFI[l][t]
-                self.CORE[count+1] = self.O[l][t] <= (1-self.SFI[l][t])*100
-                count+=2
+                M.add([(self.S[l][t],1), (self.SFI[l][t],-1)], LpConstraintLE, tag=t)
+                M.add([(self.O[l][t],1), (self.SFI[l][t],100)], LpConstraintLE, 100, t)
                 # NB: SFI is 1 if there's a shortfall for l at t, so now S and O can't be >0 at the same time
 
         # Set up Z_kt variable
         for t in self.hor:
             for k in self.commodities:
                 if k == "CASH":
-                    self.CORE[count]=   (self.R[k][t] >= self.K[k][t] * .01)
+                    M.add([(self.R[k][t],1), (self.K[k][t],-.01)], LpConstraintGE, tag=t)
                 else:
-                    self.CORE[count]=   (self.R[k][t] >= self.K[k][t] * 1)
-                self.CORE[count+1]= (self.R[k][t] <= self.K[k][t] * 10000)  # gr/ration for any commodity is =<1000 gr and >=1 gram (if included in basket) (exception for CASH commodity)
-                count+=2
+                    M.add([(self.R[k][t],1), (self.K[k][t],-1)], LpConstraintGE, tag=t)
+                M.add([(self.R[k][t],1), (self.K[k][t],-self.Rmax[k])], LpConstraintLE, tag=t)  # gr/ration for any commodity is =<1000 gr and >=1 gram (if included in basket) (exception for CASH commodity)
 
         # Set up G_g variable
         for t in self.hor:
             for g in self.foodgroups:
-                self.CORE[count]= lpSum([self.K[k][t] for k in self.commodities if self.group[k]==g]) <= 10000*self.G[g][t]
-                self.CORE[count+1]= lpSum([self.K[k][t] for k in self.commodities if self.group[k]==g]) >= self.G[g][t]
-                count+=2
+                M.add([(self.K[k][t],1) for k in self.commodities if self.group[k]==g] + [(self.G[g][t],-self.Gmax[g])], LpConstraintLE, tag=t)
+                M.add([(self.K[k][t],1) for k in self.commodities if self.group[k]==g] + [(self.G[g][t],-1)], LpConstraintGE, tag=t)
 
         # Set up FCS_g variable
         for t in self.hor:
             for g in self.fcsgroups:
-                self.CORE[count]= lpSum([self.K[k][t] for k in self.commodities if self.fcs[k]==g]) <= 10000*self.FCSG[g][t]
-                self.CORE[count+1]= lpSum([self.K[k][t] for k in self.commodities if self.fcs[k]==g]) >= self.FCSG[g][t]
-                count+=2
+                M.add([(self.K[k][t],1) for k in self.commodities if self.fcs[k]==g] + [(self.FCSG[g][t],-self.FCSGmax[g])], LpConstraintLE, tag=t)
+                M.add([(self.K[k][t],1) for k in self.commodities if self.fcs[k]==g] + [(self.FCSG[g][t],-1)], LpConstraintGE, tag=t)
 
         # Network Flow Constraints
         # Source nodes (bound outflow and set up lead time)
         for key in self.proccap.keys(): # key = (src, ndp, com)
             for t in self.hor:
-                self.CORE[count]= self.F[key[0],key[1],key[2],t] <= self.proccap[key]
-                count+=1
+                M.add([(self.F[key[0],key[1],key[2],t],1)], LpConstraintLE, self.proccap[key], t)
         for key in self.fc_cap.keys(): # key = (origin country, com, month)
             for t in self.hor:
                 if self.horizon[t].startswith(key[2]):
-                    self.CORE[count]= lpSum([self.F[proc[0],proc[1],proc[2],t] for proc in self.cost.keys() if proc[0].startswith(key[0]) and proc[2]==key[1] ]) <= self.fc_cap[key]
-                    count+=1
+                    M.add([(self.F[proc[0],proc[1],proc[2],t],1) for proc in self.fc_arcs.get((key[0],key[1]),[])], LpConstraintLE, self.fc_cap[key], t)
 
         # Transhipment nodes (flow out = flow in)
         for key in self.arr.keys(): # key = (i,k,t)  where i: transshipment node. self.arr[key] is then the set of [i,j,k,t*]'s that arrive in [i,k,t]
+            terms = [(self.F[arc[0],arc[1],arc[2],arc[3]],1) for arc in self.arr[key]] + [(self.F[arc[0],arc[1],arc[2],key[2]],-1) for arc in outcom.get((key[0],key[1]),[])]
             if key[0] in (self.DPs+self.EDPs): # includes inventory
-                self.CORE[count]= lpSum(self.F[arc[0],arc[1],arc[2],arc[3]] for arc in self.arr[key]) + self.inv[key[0],key[1],self.horizon[key[2]]] == lpSum(self.F[arc[0],arc[1],arc[2],key[2]] for arc in self.cost.keys() if arc[0]==key[0] and arc[2]==key[1]) + self.F[key[0],key[0],key[1],key[2]]
-            else: # doesn't include inventory
-                self.CORE[count]= lpSum(self.F[arc[0],arc[1],arc[2],arc[3]] for arc in self.arr[key]) + self.inv[key[0],key[1],self.horizon[key[2]]] == lpSum(self.F[arc[0],arc[1],arc[2],key[2]] for arc in self.cost.keys() if arc[0]==key[0] and arc[2]==key[1])
+                terms.append((self.F[key[0],key[0],key[1],key[2]],-1))
+            M.add(terms, LpConstraintEQ, -self.inv[key[0],key[1],self.horizon[key[2]]], key[2])
             # NB: arrivals of k in i at t + whatever arrives for free == departures of k from i at t (including inventory)
-            count+=1
 
 		# Arc capacities
         for arc in self.arccap.keys(): # arc = (orig, dest, period)
             if arc[2] in self.horizon:
                 t = self.horizon.index(arc[2])
-                self.CORE[count]= lpSum(self.F[arc[0],arc[1],k,t] for k in self.commodities) <= self.arccap[arc[0],arc[1],arc[2]]
-                count+=1
+                M.add([(self.F[arc[0],arc[1],k,t],1) for k in self.commodities], LpConstraintLE, self.arccap[arc[0],arc[1],arc[2]], t)
 
 		# Node capacities
         for t in self.hor:
             for i in (self.DPs+self.EDPs):
-                self.CORE[count]= lpSum(self.F[arc[0],arc[1],arc[2],t] for arc in self.cost.keys() if arc[0]==i) + lpSum(self.F[i,i,k,t] for k in self.commodities) <= self.nodecap[i,self.horizon[t]]
-                count+=1
+                M.add([(self.F[arc[0],arc[1],arc[2],t],1) for arc in outarcs.get(i,[])] + [(self.F[i,i,k,t],1) for k in self.commodities], LpConstraintLE, self.nodecap[i,self.horizon[t]], t)
 
-        self.gendur = time.time()-self.genstart
-        self.n_vars = len(self.F.keys() + self.R.keys() + self.CV.keys() + self.K.keys() + self.G.keys() + self.FCSG.keys() + self.S.keys() + self.O.keys() + self.SFI.keys() + self.P.keys() + self.LT.keys()) + 1
-        print "Finished preparing the model:"
-        print str(self.n_vars)+" Variables & "+str(count)+" Constraints in "+str(self.gendur)+" seconds"
-        print " "
-        self.prepped = [self.tstart.get(),self.tend.get(),self.useforecasts.get()] # Tracks whether the data has been set up yet
+
+        # Keep the model for all periods, prep_window(self) takes it from here
+        self.full = {"arcs":self.arcs, "F":self.F, "CORE":zip(M.tag,M.constraints())}
+        for name in self.VARIABLES + self.STATISTICS:
+            self.full[name] = dict(getattr(self,name))
+        del M
+        self.network = self.network_key()
+        self.record("Prep: Constraints",tick)
+
+    def presolve(self):
+        '''
+        Derives the tightest valid big-M for the indicator constraints in prep_network(self), instead of the generic 1000000000 and 10000:
+            - Pmax[src,ndp,t]: procured mt (all commodities), bounded by the supplier capacities, the (forecasted) capacity of the origin country and the arc capacity
+            - Rmax[com]: gr/ration, bounded by the nutritional requirements. A ration supplies at most 101x the requirement for any nutrient (shortfall >= 0, overshoot <= 100),
+              so nutval[k,l]/100 * R[k] <= 101 * nutreq[b,l] for the most demanding activity b
+            - Gmax[group], FCSGmax[group]: the number of commodities in the group
+        NB: Overshoot <= (1-SFI)*100 is kept as is: the bound from the rations is looser than 100
+        With self.tighten = 0 the generic big-Ms are used instead, so that the solve times can be compared (see bigm_note(self))
+        '''
+
+        tightened = 0
+        fc = {} # (src, com, month) -> capacity of the origin country
+        for key in self.fc_cap.keys(): # key = (origin country, com, month)
+            for proc in self.fc_arcs.get((key[0],key[1]),[]):
+                fc[proc[0],key[1],key[2]] = min(self.fc_cap[key],fc.get((proc[0],key[1],key[2]),self.fc_cap[key]))
+        self.Pmax = {}
+        for key in self.proccap.keys(): # key = (src, ndp, com)
+            for t in self.hor:
+                if self.F[key[0],key[1],key[2],t] is self.NoFlow:
+                    continue
+                bound = min(1000000000, self.proccap[key], fc.get((key[0],key[2],self.horizon[t][0:3]),1000000000), self.arccap.get((key[0],key[1],self.horizon[t]),1000000000))
+                self.Pmax[key[0],key[1],t] = self.Pmax.get((key[0],key[1],t),0) + bound
+        for key in self.Pmax.keys(): # key = (src, ndp, t)
+            self.Pmax[key] = min(1000000000, self.Pmax[key], self.arccap.get((key[0],key[1],self.horizon[key[2]]),1000000000))
+            if self.Pmax[key] < 1000000000:
+                tightened += 1
+        self.Rmax = {}
+        for k in self.commodities:
+            self.Rmax[k] = 10000
+            for l in self.nutrients:
+                req = max([self.nutreq[key] for key in self.nutreq.keys() if key[1]==l] + [0])
+                if self.nutval[k,l] > 0:
+                    self.Rmax[k] = min(self.Rmax[k], 101*req/(self.nutval[k,l]/100))
+            if self.Rmax[k] < 10000:
+                tightened += 1
+        self.Gmax = {}
+        for g in self.foodgroups:
+            self.Gmax[g] = max(1,min(10000,len([k for k in self.commodities if self.group[k]==g])))
+        self.FCSGmax = {}
+        for g in self.fcsgroups:
+            self.FCSGmax[g] = max(1,min(10000,len([k for k in self.commodities if self.fcs[k]==g])))
+        tightened += len(self.Gmax) + len(self.FCSGmax)
+        if self.tighten == 0:
+            for key in self.Pmax.keys():
+                self.Pmax[key] = 1000000000
+            for k in self.commodities:
+                self.Rmax[k] = 10000
+            for g in self.foodgroups:
+                self.Gmax[g] = 10000
+            for g in self.fcsgroups:
+                self.FCSGmax[g] = 10000
+            tightened = 0
+        self.tightened = tightened
+        print str(tightened) + " big-M coefficients tightened"
+
+    def bigm_note(self):
+        '''
+        Profiling: Describes the big-M presolve of the current model (see presolve(self))
+        '''
+        if self.tighten == 0:
+            return "Big-M presolve off"
+        return "Big-M presolve on: " + str(self.tightened) + " coefficients tightened"
+
+    def prep_window(self):
+        '''
+        Selects the part of the model from prep_network(self) that falls within the time horizon (self.tstart - self.tend).
+        Everything is re-indexed so that period 0 is the first month of the horizon, i.e. the rest of the model doesn't notice the difference.
+        Flows that leave before the horizon (but would arrive within it) are fixed at 0.
+        '''
+
+        tick = time.time()
+        a,b = self.periods.index(self.tstart.get()),self.periods.index(self.tend.get())
+        self.horizon = self.periods[a:b+1] # Create the subset of self.periods in which we are allowed to make decisions
+        self.hor = range(len(self.horizon)) # This list contains indices to self.horizon rather than month names
+
+        self.arcs = self.window(self.full["arcs"],a,b)
+        self.F = self.window(self.full["F"],a,b)
+        for arc in self.full["F"].keys():
+            if self.full["F"][arc] is not self.NoFlow:
+                if arc[3] < a:
+                    self.full["F"][arc].upBound = 0
+                else:
+                    self.full["F"][arc].upBound = None
+        self.pruned = len([arc for arc in self.F.keys() if self.F[arc] is self.NoFlow])
+        # C&V arcs per expenditure class (see calculate(self, NAME))
+        self.cv_arcs = {} # (FDP, t, expenditure class) -> arcs from the local markets to the FDP
+        LMset = set(self.LMs)
+        for arc in self.arcs.keys():
+            if arc[0] not in LMset:
+                continue
+            if arc[2] == "CASH":
+                g = "Non-Food Items"
+            elif self.group[arc[2]] == "CEREALS & GRAINS":
+                g = "Cereals and Grains"
+            elif self.group[arc[2]] == "PULSES & VEGETABLES":
+                g = "Vegetables and Fruits"
+            else:
+                g = "Other Food Items"
+            self.cv_arcs.setdefault((arc[1],arc[3],g),[]).append(arc)
+        for name in self.VARIABLES:
+            setattr(self,name,self.window(self.full[name],a,b))
+        self.stats["Lead Time"] =self.LT # initialised as LTsum, but LT makes more sense to track
+        for name in self.STATISTICS:
+            getattr(self,name).clear()
+            getattr(self,name).update(self.window(self.full[name],a,b))
+        for name in self.TOTALS:
+            stat = getattr(self,name)
+            stat["Total"] = lpSum(stat[t] for t in self.hor)
+            if name in self.AVERAGES:
+                stat["Average"] = stat["Total"]/float(len(self.hor))
+        # Demand of the other activities (grams/month), only the selection of activities changes per scenario (see calculate(self, NAME))
+        self.act_demand = {} # activity -> {(FDP, com, t): grams}
+        for act in self.beneficiaries: # NB: not b, that name holds the end of the horizon (used for self.CORE below)
+            self.act_demand[act] = {}
+            for i in self.FDPs:
+                for t in self.hor:
+                    if self.dem[act,i,self.horizon[t]] == 0:
+                        continue
+                    for k in self.commodities:
+                        if self.baskets[act,k]*self.feedingdays[act,k] != 0:
+                            self.act_demand[act][i,k,t] = self.dem[act,i,self.horizon[t]]*self.baskets[act,k]*self.feedingdays[act,k]
+        self.CORE = dict(enumerate([con for t, con in self.full["CORE"] if a <= t <= b])) # Used to store general constraints
+        # Core model: the objective and the general constraints, shared by all scenarios (see calculate(self, NAME))
+        self.core = LpProblem("UNWFP",LpMinimize)
+        self.core += self.TC["Total"]
+        for key in self.CORE.keys():
+            self.core += self.CORE[key]
+        self.n_core = len(self.core.constraints)
+        self.n_vars = len(self.F.keys()) - self.pruned + len(self.R.keys() + self.CV.keys() + self.K.keys() + self.G.keys() + self.FCSG.keys() + self.S.keys() + self.O.keys() + self.SFI.keys() + self.P.keys() + self.LT.keys()) + 1
+        self.record("Prep: Time horizon",tick)
+
+    def solver(self, prob):
+        '''
+        Returns the solver for calculate(self, NAME)
+        The backend, threads, gaps, time limit, presolve and cuts are set per scenario (see draw_solveropts(self) and solver_options(self, solver)).
+        By default, CBC is used (the one that comes with PuLP, unless another CBC is installed). It is handed the model through a pipe rather than an .mps file (see PipedCBC),
+        only the solution (and a MIP start) go through files in the system's temp folder rather than the script's folder.
+        During sweeps (self.warmstart), CBC is given the binaries of the previous solution as a MIP start (it fixes them and solves the LP for the flows and rations), so that it has an incumbent right away.
+        '''
+
+        solver = None
+        backend = self.solver_backend.get()
+        if backend != "Default":
+            solver = self.backends().get(backend)
+            if solver is None:
+                print "<<<WARNING>>> Solver not installed: " + backend + " (the default solver is used instead)"
+        if solver is None:
+            solver = self.backends().get("CBC", LpSolverDefault.copy())
+        if isinstance(solver, COIN_CMD):
+            solver = PipedCBC(path=solver.path, msg=solver.msg)
+        solver.tmpDir = tempfile.gettempdir()
+        self.solver_options(solver)
+        if self.warmstart == 1 and len(self.incumbent) > 0 and isinstance(solver, COIN_CMD):
+            # NB: CBC reads the model from an .mps file with normalised names (X0000000, X0000001, ...), so the MIP start has to use the same names
+            names = prob.normalisedNames()[1]
+            path = os.path.join(solver.tmpDir, "%d-aidm.mst" % os.getpid())
+            f = open(path, 'w')
+            for i, v in enumerate(prob.variables()):
+                if v.name in self.incumbent:
+                    f.write("%d %s %s\n" % (i, names[v.name], repr(self.incumbent[v.name])))
+            f.close()
+            solver.options = solver.options + ["mips", path, "preprocess", "off"] # NB: CBC 2.9 returns corrupted values when a MIP start is combined with its preprocessing
+        return solver
+
+    def backends(self):
+        '''
+        Returns the installed solver backends (see BACKENDS), e.g. {"CBC": PULP_CBC_CMD()}
+        NB: HiGHS needs a PuLP version that ships a HiGHS interface
+        '''
+
+        found = {}
+        for backend in self.BACKENDS.keys():
+            for name in self.BACKENDS[backend]:
+                if name in globals() and globals()[name]().available():
+                    found[backend] = globals()[name]()
+                    break
+        return found
+
+    def solver_options(self, solver):
+        '''
+        Applies the solver settings of the current scenario (see draw_solveropts(self)) to solver
+        Empty settings ("N/A" or "Default") leave the solver's own defaults in place
+        '''
+
+        opts = {}
+        for key, var, cast in [["threads",self.solver_threads,int], ["gaprel",self.solver_gaprel,float], ["gapabs",self.solver_gapabs,float], ["time",self.solver_time,float]]:
+            if str(var.get()) in ["","N/A"]:
+                continue
+            try:
+                opts[key] = cast(var.get())
+            except ValueError:
+                print "<<ERROR>> Could not set solver setting (" + key + "): " + str(var.get())
+        for key, var in [["presolve",self.solver_presolve], ["cuts",self.solver_cuts]]:
+            if var.get() != "Default":
+                opts[key] = var.get().lower() # "on" or "off"
+
+        # NB: options are reassigned rather than appended to, as PuLP's solvers share their default options list
+        if isinstance(solver, COIN_CMD):
+            solver.threads = opts.pop("threads", None)
+            solver.fracGap = opts.pop("gaprel", None)
+            solver.maxSeconds = opts.pop("time", None)
+            options = []
+            if "gapabs" in opts:
+                options += ["allow", str(opts.pop("gapabs"))]
+            for key in ["presolve","cuts"]:
+                if key in opts:
+                    options += [key, opts.pop(key)]
+            solver.options = solver.options + options
+        elif isinstance(solver, GLPK_CMD):
+            options = []
+            if "gaprel" in opts:
+                options += ["--mipgap", str(opts.pop("gaprel"))]
+            if "time" in opts:
+                options += ["--tmlim", str(int(opts.pop("time")))]
+            if opts.get("presolve") == "on":
+                options += ["--presol"]
+            if opts.get("cuts") == "on":
+                options += ["--cuts"]
+            opts.pop("presolve", None) # NB: glpsol runs without presolve and cuts by default
+            opts.pop("cuts", None)
+            solver.options = solver.options + options
+        elif hasattr(solver, "optionsDict"): # newer PuLP versions (e.g. HiGHS)
+            for key, name in [["threads","threads"], ["gaprel","gapRel"], ["gapabs","gapAbs"], ["time","timeLimit"]]:
+                if key in opts:
+                    solver.optionsDict[name] = opts.pop(key)
+        for key in opts.keys():
+            print "<<<WARNING>>> Solver setting not supported by " + solver.__class__.__name__ + ": " + key
+
+    def drop_user_constraints(self, prob):
+        '''
+        Removes the constraints of a scenario from the core model, i.e. everything added after the general constraints
+        '''
+
+        for name in prob.constraints.keys()[self.n_core:]:
+            del prob.constraints[name]
+        prob.modifiedConstraints = []
+
+    def window(self, d, a, b):
+        '''
+        Returns the entries of d for periods a to b (indices to self.periods), re-indexed to start at 0
+        Keys are periods, or tuples that end with a period. Nested dictionaries (e.g. self.R[k][t]) are sliced per entry.
+        '''
+
+        w = {}
+        for key, val in d.iteritems():
+            if type(val) is dict:
+                w[key] = self.window(val,a,b)
+            elif isinstance(key, tuple):
+                if a <= key[-1] <= b:
+                    w[key[:-1]+(key[-1]-a,)] = val
+            elif a <= key <= b:
+                w[key-a] = val
+        return w
+
+    def network_key(self):
+        '''
+        Returns the settings that the model from prep_network(self) depends on; when these change, the model needs to be rebuilt
+        '''
+        return [self.useforecasts.get(),self.demand_points(),sorted(self.nutreq.items()),self.include_rules(),self.tighten] # NB: nutritional requirements determine the big-Ms (see presolve(self))
+
+
+    def prep_key(self):
+        '''
+        Returns the settings that the model from prep(self) depends on; when these change, prep(self) needs to be called again
+        '''
+        return [self.tstart.get(),self.tend.get()] + self.network_key()
+
+    def include_rules(self):
+        '''
+        Returns the user's include rules (procurement, routing and C&V); the arcs they name are never pruned (see live_arcs(self, outcom))
+        '''
+        return [sorted(self.user_add_proc_int.items()),sorted(self.user_add_proc_loc.items()),sorted(self.user_add_route.items()),sorted(self.user_add_cv.items())]
+
+    def forced_arcs(self):
+        '''
+        Returns the set of arcs [i,j,k,t] in self.arcs that an include rule puts a lower bound on (see calculate(self, NAME))
+        NB: uses the arc indexes from prep_network(self), so only call it from there
+        '''
+        forced = []
+        for item in self.user_add_proc_int.items(): # item = (country, inco, ndp, com) (mt,t)
+            c,i,l,k = item[0]
+            arcs = self.proc_index.find(country=c, inco=i, ndp=(self.ISs+self.RSs) if l=="Any" else l, com=k)
+            forced += [(arc,month) for arc in arcs for month in item[1][1]]
+        for item in self.user_add_proc_loc.items(): # item = (country, inco, ndp, com) (mt,t)
+            c,i,l,k = item[0]
+            arcs = self.proc_index.find(country=c, inco=i, ndp=self.LSs if l=="Any" else l, com=k)
+            forced += [(arc,month) for arc in arcs for month in item[1][1]]
+        for route in self.user_add_route.items(): # route = (loc1, loc2, com) (mt,t)
+            arcs = self.route_index.find(origin=route[0][0], dest=route[0][1], com=route[0][2])
+            forced += [(arc,month) for arc in arcs for month in route[1][1]]
+        for i in self.user_add_cv.items(): # i = (LM, com, t) (mt)
+            forced.append((("Local Markets - C&V",i[0][0],i[0][1]),i[0][2]))
+        arcs = set()
+        for arc, month in forced:
+            if month in self.horizon and (arc[0],arc[1],arc[2],self.horizon.index(month)) in self.arcs:
+                arcs.add((arc[0],arc[1],arc[2],self.horizon.index(month)))
+        return arcs
+
+    def rule_flows(self, flows):
+        '''
+        Checks the flows that an include rule puts a lower bound on (see calculate(self, NAME)) and returns them
+        Raises a ValueError (reported as a rule error) if the rule matches no arc, or if no flow can reach any of its arcs (see forced_arcs(self)),
+        as the scenario would be infeasible either way
+        '''
+        if len(flows) == 0:
+            print "<<ERROR>> The rule matches no arc in the network"
+            raise ValueError("no arcs")
+        if all(v is self.NoFlow for v in flows):
+            print "<<ERROR>> No flow can reach this decision in the network (see live_arcs(self, outcom))"
+            raise ValueError("pruned arcs")
+        return flows
+
+    def demand_points(self):
+        '''
+        Returns the set of (fdp, month) with demand for any activity (including tactical demand)
+        '''
+        points = set()
+        for key in self.dem.keys():
+            if len(key) == 3 and self.dem[key] > 0: # key = (activity, fdp, month)
+                points.add((key[1],key[2]))
+        for key in self.tact_demand.keys(): # key = (fdp, com, month)
+            points.add((key[0],key[2]))
+        return points
+
+    def live_arcs(self, outcom):
+        '''
+        Reachability pass over the space-time network (self.arr), used by prep(self) to prune the flow variables.
+        Returns the set of arcs [i,j,k,t] in self.arcs that can carry flow:
+            - the arc leads to an FDP with demand (backward pass), or is downstream of inventory that needs to go somewhere
+            - or the arc is named in an include rule (see forced_arcs(self)), or is upstream or downstream of one
+            - and something can arrive in i at t in the first place (forward pass from the sources and inventories)
+        Flows on all other arcs are 0 in any useful solution: e.g. arrivals beyond the end of the horizon, movements after the last month with demand or to locations without demand.
+        NB: demand of all activities counts (regardless of the selected beneficiary type), so the same network serves every scenario
+        '''
+
+        FDPset = set(self.FDPs)
+        demand = set([(p[0],self.horizon.index(p[1])) for p in self.demand_points() if p[1] in self.horizon]) # (fdp, t) with demand
+        head = {} # [i,j,k,t] -> (j,k,t*) where the flow arrives
+        for key in self.arr.keys():
+            for arc in self.arr[key]:
+                head[tuple(arc)] = key
+
+        # Backward pass: everything that can reach demand (or an arc that the user forces flow on)
+        forced = self.forced_arcs()
+        live = set(forced)
+        seen = set()
+        stack = [(arc[0],arc[2],arc[3]) for arc in forced]
+        for arc in self.cost.keys():
+            if arc[1] in FDPset:
+                for t in self.hor:
+                    if (arc[1],t) in demand:
+                        live.add((arc[0],arc[1],arc[2],t))
+                        stack.append((arc[0],arc[2],t))
+        while stack:
+            state = stack.pop()
+            if state in seen:
+                continue
+            seen.add(state)
+            for arc in self.arr.get(state,[]):
+                live.add(tuple(arc))
+                stack.append((arc[0],arc[2],arc[3]))
+
+        # Inventory (and forced flow) has to leave through some arc (the balance at transshipment nodes is an equality), so keep everything downstream of it
+        seen = set()
+        stack = [key for key in self.arr.keys() if self.inv[key[0],key[1],self.horizon[key[2]]] > 0] + [head[arc] for arc in forced if arc in head]
+        while stack:
+            state = stack.pop()
+            if state in seen:
+                continue
+            seen.add(state)
+            i,k,t = state
+            arcs = [(arc[0],arc[1],arc[2],t) for arc in outcom.get((i,k),[])]
+            if (i,i,k,t) in self.arcs:
+                arcs.append((i,i,k,t)) # inventory kept in (E)DPs
+            for arc in arcs:
+                live.add(arc)
+                if arc in head:
+                    stack.append(head[arc])
+
+        # Forward pass: transshipment nodes only pass on what arrives (or is in stock)
+        out = {} # (i,k,t) -> live arcs leaving i with k at t
+        for arc in live:
+            out.setdefault((arc[0],arc[2],arc[3]),[]).append(arc)
+        seen = set()
+        stack = [state for state in out.keys() if state not in self.arr or self.inv[state[0],state[1],self.horizon[state[2]]] > 0]
+        keep = set()
+        while stack:
+            state = stack.pop()
+            if state in seen:
+                continue
+            seen.add(state)
+            for arc in out.get(state,[]):
+                keep.add(arc)
+                if arc in head:
+                    stack.append(head[arc])
+        return keep
+
+    def linsum(self, terms):
+        '''
+        Returns the linear expression sum(coefficient * variable) for an iterable of (variable, coefficient) pairs
+        Same result as lpSum(), but doesn't create an intermediate expression for each term (which is what makes large statistics slow to build)
+        '''
+
+        e = LpAffineExpression()
+        for v, c in terms:
+            if v is self.NoFlow: # pruned arc
+                continue
+            if v in e:
+                e[v] += c
+            else:
+                e[v] = c
+        return e
 
     def calculate(self, NAME):
         '''
         Add user inputs to the core model (from prep(self)) and set up the optimisation model.
         The resulting LP is then sent to the solver.
         '''
-        if self.prepped != [self.tstart.get(),self.tend.get(),self.useforecasts.get()]: # the general constraints have not been set yet for the current time horizon
+        if self.prepped != self.prep_key(): # the general constraints have not been set yet for the current time horizon
             self.prep()
         self.calcstart = time.time()
         print "Calculating scenario: " + NAME
         print "Including the general constraints"
         self.errors = 0 # will keep track of raised errors
-        self.frame_right.update_idletasks()
+        self.update_idle()
 
 
 
-        # Creates the 'prob' variable to contain the problem data
-        prob = LpProblem("UNWFP",LpMinimize)
-        prob += self.TC["Total"]
-
-        for key in self.CORE.keys():
-            prob += self.CORE[key] # Adds the general constraints that were prepared in self.prep()
+        # The 'prob' variable contains the problem data: the core model from self.prep() is reused, the user constraints of this scenario are added to it (and removed again after solving)
+        prob = self.core
+        self.drop_user_constraints(prob) # in case a previous scenario was interrupted
         self.n_constr = len(self.CORE.keys())
+        tick = self.record(NAME + ": General constraints",self.calcstart)
         print "Setting up constraints from user input"
 
         # Some months have no demand, resulting in some exceptions
@@ -1233,38 +1742,39 @@ class UNWFPModel:
         if feed_days == 0:
             feed_days = 30
             # NB: If no food basket was pre-defined for this activity, assume the default of 30 feeding days
+        extra = {} # (FDP, com, t) -> demand from other activities (grams/month)
+        for b in self.activities:
+            for key, d in self.act_demand[b].iteritems(): # see prep_window(self)
+                extra[key] = extra.get(key,0) + d
+        M = SparseRows(self.NoFlow) # Demand rows are assembled as a sparse matrix (see prep)
         for i in self.FDPs:
             for k in self.commodities:
                 for t in self.hor:
-                    extra_demand = sum(self.dem[b,i,self.horizon[t]]*self.baskets[b,k]*self.feedingdays[b,k] for b in self.activities)
+                    extra_demand = extra.get((i,k,t),0)
                     if self.supply_tact.get() == 1:
-                        if (i,k,self.horizon[t]) in self.tact_demand.keys():
+                        if (i,k,self.horizon[t]) in self.tact_demand:
                             if self.tactboxes[i].get()==1 and self.tactboxes[k].get()==1 and self.tactboxes[self.horizon[t]].get()==1:
                                 extra_demand += self.tact_demand[i,k,self.horizon[t]] * 1000000
-                    prob += lpSum(1000000*self.F[arc[0],arc[1],arc[2],t] for arc in self.cost.keys() if arc[1]==i and arc[2]==k) >= ( self.dem[self.ben.get(),i,self.horizon[t]] * feed_days * self.R[k][t] + extra_demand ) * self.scaleup
+                    M.add([(self.F[arc[0],arc[1],arc[2],t],1000000) for arc in self.fdp_arcs.get((i,k),[])] + [(self.R[k][t],-self.dem[self.ben.get(),i,self.horizon[t]] * feed_days * self.scaleup)], LpConstraintGE, extra_demand * self.scaleup)
                     #             1000000 grams/mt * mt supplied = grams supplied /month for (i,k,t)                             == amount of beneficiaries * 30 days/month * gr/day + demand from other activities
-                    self.n_constr += 1
+        self.n_constr += M.add_to(prob)
 
         # Variable food basket
         if self.varbasket.get()=="Fix All":
             temp = [t for t in self.hor if t not in self.empty]
-            for t1 in temp:
-                for t2 in temp:
-                    if t1!=t2:
-                        # t1 and t2 are now two non-empty time periods in the horizon
-                        for k in self.commodities:
-                            prob += self.R[k][t1] == self.R[k][t2]
-                            # NB: Traditionally Y[k][t]=Y[k][t+1] would be used, but that would conflict with time periods where we have no demand (and thus no food basket)
-                            self.n_constr += 1
+            for t1, t2 in zip(temp[:-1],temp[1:]):
+                # t1 and t2 are now two consecutive non-empty time periods in the horizon (a chain of equalities fixes the basket across all of them)
+                for k in self.commodities:
+                    prob += self.R[k][t1] == self.R[k][t2]
+                    # NB: Traditionally Y[k][t]=Y[k][t+1] would be used, but that would conflict with time periods where we have no demand (and thus no food basket)
+                    self.n_constr += 1
         elif self.varbasket.get()=="Fix Commodities":
             temp = [t for t in self.hor if t not in self.empty]
-            for t1 in temp:
-                for t2 in temp:
-                    if t1!=t2:
-                        # t1 and t2 are now two non-empty time periods in the horizon
-                        for k in self.commodities:
-                            prob += self.K[k][t1] == self.K[k][t2]
-                            self.n_constr += 1
+            for t1, t2 in zip(temp[:-1],temp[1:]):
+                # t1 and t2 are now two consecutive non-empty time periods in the horizon
+                for k in self.commodities:
+                    prob += self.K[k][t1] == self.K[k][t2]
+                    self.n_constr += 1
 
         # Sensible Food Basket Constraints
         if(self.sensible.get() == 1):
@@ -1353,10 +1863,7 @@ class UNWFPModel:
         # Expenditure patterns
         for t in self.hor:
             for i in self.FDPs:
-                val_g = lpSum(self.F[key]*self.arcs["Local Markets - C&V",key[0],key[2],key[3]] for key in self.arcs.keys() if key[0] in self.LMs and key[1]==i and key[3]==t and self.group[key[2]]=="CEREALS & GRAINS")
-                val_v = lpSum(self.F[key]*self.arcs["Local Markets - C&V",key[0],key[2],key[3]] for key in self.arcs.keys() if key[0] in self.LMs and key[1]==i and key[3]==t and self.group[key[2]]=="PULSES & VEGETABLES")
-                val_c = lpSum(self.F[key]*self.arcs["Local Markets - C&V",key[0],key[2],key[3]] for key in self.arcs.keys() if key[0] in self.LMs and key[1]==i and key[3]==t and key[2]=="CASH")
-                val_o = lpSum(self.F[key]*self.arcs["Local Markets - C&V",key[0],key[2],key[3]] for key in self.arcs.keys() if key[0] in self.LMs and key[1]==i and key[3]==t and self.group[key[2]]!="CEREALS & GRAINS" and self.group[key[2]]!="PULSES & VEGETABLES" and key[2]!="CASH")
+                val_g, val_v, val_c, val_o = [self.linsum((self.F[key],self.arcs["Local Markets - C&V",key[0],key[2],key[3]]) for key in self.cv_arcs.get((i,t,g),[])) for g in ["Cereals and Grains","Vegetables and Fruits","Non-Food Items","Other Food Items"]] # see prep_window(self)
                 prob += self.CV[i][t] == val_g + val_v + val_c + val_o
                 self.n_constr += 1
                 if self.modality.get() == "Cash":
@@ -1392,7 +1899,7 @@ class UNWFPModel:
         for i in self.user_add_cv.items(): # i = (LM, com, t) (mt)
             try:
                 t = self.horizon.index(i[0][2])
-                prob += self.F["Local Markets - C&V", i[0][0], i[0][1], t] >= float(i[1])
+                prob += lpSum(self.rule_flows([self.F["Local Markets - C&V", i[0][0], i[0][1], t]])) >= float(i[1])
                 self.n_constr += 1
             except:
                 print "<<ERROR>> Could not add Local Procurement decision (LM, com, t, mt):"
@@ -1404,16 +1911,10 @@ class UNWFPModel:
             for month in i[1]:
                 try:
                     t = self.horizon.index(month)
-                    if i[0][0]=="Any":
-                        if i[0][1]=="Any":
-                            prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[1] in self.LMs]) == 0
-                        else:
-                            prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[1] in self.LMs and arc[2]==i[0][1]]) == 0
-                    else:
-                        if i[0][1]=="Any":
-                            prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[1] in self.LMs and arc[1]==i[0][0]]) == 0
-                        else:
-                            prob += self.F["Local Markets - C&V", i[0][0], i[0][1], t] == 0
+                    if i[0][0]!="Any" and i[0][1]!="Any":
+                        prob += self.F["Local Markets - C&V", i[0][0], i[0][1], t] == 0
+                    else: # see prep_network(self)
+                        prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proc_index.find(ndp=self.LMs if i[0][0]=="Any" else i[0][0], com=i[0][1])]) == 0
                     self.n_constr += 1
                 except:
                     print "<<ERROR>> Could not exclude Local Procurement decision (LM/LS, com, t):"
@@ -1440,11 +1941,13 @@ class UNWFPModel:
             self.n_constr += 6
 
         # Supply (all) demand for selected beneficiary type
+        M = SparseRows(self.NoFlow)
         for t in self.hor:
             for l in self.nutrients:
-                prob += lpSum([self.nutval[k,l]/100*self.R[k][t] for k in self.commodities]) == self.nutreq[self.ben.get(),l] - self.S[l][t]*self.nutreq[self.ben.get(),l] + self.O[l][t]*self.nutreq[self.ben.get(),l]
+                M.add([(self.R[k][t],self.nutval[k,l]/100) for k in self.commodities] + [(self.S[l][t],self.nutreq[self.ben.get(),l]), (self.O[l][t],-self.nutreq[self.ben.get(),l])], LpConstraintEQ, self.nutreq[self.ben.get(),l])
                 #                      nutrient/gr * gr/ration = nutrient/ration supplied         ==   nutrient/ration requirement - shortfalls + overshoot (slack variables)
-                self.n_constr += 1
+        self.n_constr += M.add_to(prob)
+        del M
 
         # Input Commodity Constraints
         for item in self.user_add_com.items(): # k = (com) (minrat, maxrat)
@@ -1507,28 +2010,11 @@ class UNWFPModel:
             for month in item[1][1]:
                 try: # It's tricky to guide the input in such a way that the result is always a valid procurement decision, hence the try/except
                     t = self.horizon.index(month)
-                    if c=="Any":
-                        if i=="Any":
-                            if l=="Any":
-                                prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[1] in (self.ISs+self.RSs) and arc[2]==k]) >= q
-                            else:
-                                prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[1]==l and arc[2]==k]) >= q
-                        else:
-                            if l=="Any":
-                                prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[0].endswith(i) and arc[1] in (self.ISs+self.RSs) and arc[2]==k]) >= q
-                            else:
-                                prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[0].endswith(i) and arc[1]==l and arc[2]==k]) >= q
-                    else:
-                        if i=="Any":
-                            if l=="Any":
-                                prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[0].startswith(c) and arc[1] in (self.ISs+self.RSs) and arc[2]==k]) >= q
-                            else:
-                                prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[0].startswith(c) and arc[1]==l and arc[2]==k]) >= q
-                        else:
-                            if l=="Any":
-                                prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[0]==c+" - "+i and arc[1] in (self.ISs+self.RSs) and arc[2]==k]) >= q
-                            else:
-                                prob += self.F[c+" - "+i,l,k,t] >= q
+                    if c!="Any" and i!="Any" and l!="Any":
+                        flows = [self.F[c+" - "+i,l,k,t]]
+                    else: # see prep_network(self)
+                        flows = [self.F[arc[0],arc[1],arc[2],t] for arc in self.proc_index.find(country=c, inco=i, ndp=(self.ISs+self.RSs) if l=="Any" else l, com=k)]
+                    prob += lpSum(self.rule_flows(flows)) >= q
                     self.n_constr += 1
                 except:
                     print "<<ERROR>> Could not add Procurement Decision (int):"
@@ -1542,28 +2028,11 @@ class UNWFPModel:
             for month in item[1][1]:
                 try: # It's tricky to guide the input in such a way that the result is always a valid procurement decision, hence the try/except
                     t = self.horizon.index(month)
-                    if c=="Any":
-                        if i=="Any":
-                            if l=="Any":
-                                prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[1] in self.LSs and arc[2]==k]) >= q
-                            else:
-                                prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[1]==l and arc[2]==k]) >= q
-                        else:
-                            if l=="Any":
-                                prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[0].endswith(i) and arc[1] in self.LSs and arc[2]==k]) >= q
-                            else:
-                                prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[0].endswith(i) and arc[1]==l and arc[2]==k]) >= q
-                    else:
-                        if i=="Any":
-                            if l=="Any":
-                                prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[0].startswith(c) and arc[1] in self.LSs and arc[2]==k]) >= q
-                            else:
-                                prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[0].startswith(c) and arc[1]==l and arc[2]==k]) >= q
-                        else:
-                            if l=="Any":
-                                prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[0]==c+" - "+i and arc[1] in self.LSs and arc[2]==k]) >= q
-                            else:
-                                prob += self.F[c+" - "+i,l,k,t] >= q
+                    if c!="Any" and i!="Any" and l!="Any":
+                        flows = [self.F[c+" - "+i,l,k,t]]
+                    else: # see prep_network(self)
+                        flows = [self.F[arc[0],arc[1],arc[2],t] for arc in self.proc_index.find(country=c, inco=i, ndp=self.LSs if l=="Any" else l, com=k)]
+                    prob += lpSum(self.rule_flows(flows)) >= q
                     self.n_constr += 1
                 except:
                     print "<<ERROR>> Could not add Procurement Decision (loc):"
@@ -1577,28 +2046,7 @@ class UNWFPModel:
             for month in item[1]:
                 try:
                     t = self.horizon.index(month)
-                    if c=="Any":
-                        if k=="Any":
-                            if l=="Any":
-                                prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[1] in (self.ISs+self.RSs)]) == 0
-                            else:
-                                prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[1]==l]) == 0
-                        else:
-                            if l=="Any":
-                                prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[1] in (self.ISs+self.RSs) and arc[2]==k]) == 0
-                            else:
-                                prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[1]==l and arc[2]==k]) == 0
-                    else:
-                        if k=="Any":
-                            if l=="Any":
-                                prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[0].startswith(c) and arc[1] in (self.ISs+self.RSs)]) == 0
-                            else:
-                                prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[0].startswith(c) and arc[1]==l]) == 0
-                        else:
-                            if l=="Any":
-                                prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[0].startswith(c) and arc[1] in (self.ISs+self.RSs) and arc[2]==k]) == 0
-                            else:
-                                prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[0].startswith(c) and arc[1]==l and arc[2]==k]) == 0
+                    prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proc_index.find(country=c, ndp=(self.ISs+self.RSs) if l=="Any" else l, com=k)]) == 0 # see prep_network(self)
                     self.n_constr += 1
                 except:
                     print "<<ERROR>> Could not exclude Procurement Decision:"
@@ -1612,28 +2060,7 @@ class UNWFPModel:
             for month in item[1]:
                 try:
                     t = self.horizon.index(month)
-                    if c=="Any":
-                        if k=="Any":
-                            if l=="Any":
-                                prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[1] in self.LSs]) == 0
-                            else:
-                                prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[1]==l]) == 0
-                        else:
-                            if l=="Any":
-                                prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[1] in self.LSs and arc[2]==k]) == 0
-                            else:
-                                prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[1]==l and arc[2]==k]) == 0
-                    else:
-                        if k=="Any":
-                            if l=="Any":
-                                prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[0].startswith(c) and arc[1] in self.LSs]) == 0
-                            else:
-                                prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[0].startswith(c) and arc[1]==l]) == 0
-                        else:
-                            if l=="Any":
-                                prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[0].startswith(c) and arc[1] in self.LSs and arc[2]==k]) == 0
-                            else:
-                                prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proccap.keys() if arc[0].startswith(c) and arc[1]==l and arc[2]==k]) == 0
+                    prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.proc_index.find(country=c, ndp=self.LSs if l=="Any" else l, com=k)]) == 0 # see prep_network(self)
                     self.n_constr += 1
                 except:
                     print "<<ERROR>> Could not exclude Procurement Decision:"
@@ -1646,16 +2073,11 @@ class UNWFPModel:
             for month in route[1][1]:
                 try:
                     t = self.horizon.index(month)
-                    if route[0][1]=="Any":
-                        if route[0][2]=="Any":
-                            prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.cost.keys() if arc[0]==route[0][0]]) >= float(route[1][0])
-                        else:
-                            prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.cost.keys() if arc[0]==route[0][0] and arc[2]==route[0][2]]) >= float(route[1][0])
-                    else:
-                        if route[0][2]=="Any":
-                            prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.cost.keys() if arc[0]==route[0][0] and arc[1]==route[0][1]]) >= float(route[1][0])
-                        else:
-                            prob += self.F[route[0][0],route[0][1],route[0][2],t] >= float(route[1][0])
+                    if route[0][1]!="Any" and route[0][2]!="Any":
+                        flows = [self.F[route[0][0],route[0][1],route[0][2],t]]
+                    else: # see prep_network(self)
+                        flows = [self.F[arc[0],arc[1],arc[2],t] for arc in self.route_index.find(origin=route[0][0], dest=route[0][1], com=route[0][2])]
+                    prob += lpSum(self.rule_flows(flows)) >= float(route[1][0])
                     self.n_constr += 1
                 except :
                     print "<<ERROR>> Could not include Routing Decision:"
@@ -1668,16 +2090,10 @@ class UNWFPModel:
             for month in route[1]:
                 try:
                     t = self.horizon.index(month)
-                    if route[0][1]=="Any":
-                        if route[0][2]=="Any":
-                            prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.cost.keys() if arc[0]==route[0][0]]) == 0
-                        else:
-                            prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.cost.keys() if arc[0]==route[0][0] and arc[2]==route[0][2]]) == 0
-                    else:
-                        if route[0][2]=="Any":
-                            prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.cost.keys() if arc[0]==route[0][0] and arc[1]==route[0][1]]) == 0
-                        else:
-                            prob += self.F[route[0][0],route[0][1],route[0][2],t] == 0
+                    if route[0][1]!="Any" and route[0][2]!="Any":
+                        prob += self.F[route[0][0],route[0][1],route[0][2],t] == 0
+                    else: # see prep_network(self)
+                        prob += lpSum([self.F[arc[0],arc[1],arc[2],t] for arc in self.route_index.find(origin=route[0][0], dest=route[0][1], com=route[0][2])]) == 0
                     self.n_constr += 1
                 except :
                     print "<<ERROR>> Could not exclude Routing Decision:"
@@ -1710,8 +2126,10 @@ class UNWFPModel:
                 s = list(self.EDPs)
             try:
                 t = self.horizon.index(i[0][1])
-                prob += lpSum(self.F[arc[0],arc[1],arc[2],t] for arc in self.cost.keys() if arc[0]==l) <= mx/100.0 * lpSum(self.F[arc[0],arc[1],arc[2],t] for arc in self.cost.keys() if arc[0] in s)
-                prob += lpSum(self.F[arc[0],arc[1],arc[2],t] for arc in self.cost.keys() if arc[0]==l) >= mn/100.0 * lpSum(self.F[arc[0],arc[1],arc[2],t] for arc in self.cost.keys() if arc[0] in s)
+                out = lpSum(self.F[arc[0],arc[1],arc[2],t] for arc in self.route_index.find(origin=l)) # see prep_network(self)
+                tot = lpSum(self.F[arc[0],arc[1],arc[2],t] for arc in self.route_index.find(origin=s))
+                prob += out <= mx/100.0 * tot
+                prob += out >= mn/100.0 * tot
                 self.n_constr += 2
             except:
                 print "<<ERROR>> Could not set Capacity Allocation Decision:"
@@ -1850,45 +2268,52 @@ class UNWFPModel:
 
 
 
+        tick = self.record(NAME + ": User constraints",tick)
         print "Finished defining the optimisation model:"
         print str(self.n_vars) + " Variables & " + str(self.n_constr) + " Constraints"
         print " "
         print "Solving..."
-        prob.writeLP("AIDM.lp") # The problem data is written to an .lp file
-        prob.solve() # The problem is solved using PuLP's choice of Solver
+        if self.writelp == 1: # Debug mode
+            prob.writeLP("AIDM.lp") # The problem data is written to an .lp file
+            tick = self.record(NAME + ": Write LP",tick)
+        solver = self.solver(prob)
+        prob.solve(solver)
+        tick = self.record(NAME + ": Solve",tick,self.bigm_note()) # NB: compare with a run without the big-M presolve (self.tighten = 0) to see its effect on the solve time
         self.calcdur = time.time()-self.calcstart
         print "Solved!"
         self.status = LpStatus[prob.status]
+        if self.status == "Not Solved" and getattr(solver, "timelimit_solution", False):
+            # NB: PuLP reports CBC's "Stopped on time" as Not Solved, also when CBC found an integer solution (see PipedCBC)
+            print "<<<WARNING>>> Time limit reached: the solution is feasible, but may not be optimal"
+            self.status = "Feasible (time limit)"
+        if self.warmstart == 1 and self.status in self.SOLVED:
+            self.incumbent = dict((v.name, v.varValue) for v in prob.variables() if v.cat == LpInteger and v.varValue is not None) # Binaries (K, G, FCSG, SFI, P) only, see solver(self, prob)
+        self.drop_user_constraints(prob)
         print "Solver status: ", self.status
         print "Scenario time: " , self.fmt_wcommas(self.calcdur)[1:] + " seconds"
         print " "
 
-        if self.status == "Optimal":
+        if self.status in self.SOLVED:
             self.display_outputs(NAME) # Show KPIs for the solution
-        self.frame_right.update_idletasks()
-
-        mypath = os.path.dirname(os.path.abspath(__file__))
-        (_, _, filenames) = os.walk(mypath).next()
-        for f in filenames:
-            if f.endswith(".mps"):
-                try:
-                    os.remove(f)
-                except:
-                    None
+            self.record(NAME + ": Display outputs",tick)
+        self.update_idle()
 
     def objset(self):
         '''
         Solve the current scenario.
         '''
 
-        if self.prepped != [self.tstart.get(),self.tend.get(),self.useforecasts.get()]: # the general constraints have not been set yet for the current time horizon
+        if self.prepped != self.prep_key(): # the general constraints have not been set yet for the current time horizon
             self.prep()
         # set up analysis
         script_dir = os.path.dirname(os.path.abspath(__file__))
         dest_dir = os.path.join(script_dir, 'output')
         self.calculate(self.scenname.get())
-        if self.status == "Optimal":
+        if self.status in self.SOLVED:
+            tick = time.time()
             self.csv_outputs(os.path.join(dest_dir,self.scenname.get()),self.scenname.get())
+            self.record(self.scenname.get() + ": Output files",tick)
+        self.csv_profile(os.path.join(dest_dir,self.fmt_filename(self.scenname.get()))) # NB: also for infeasible scenarios, so that the profile does not carry over to the next scenario
         self.countscen+=1
         self.scenname.set("Scenario_"+str(self.countscen).zfill(3))
 
@@ -1925,7 +2350,7 @@ class UNWFPModel:
 
         # run the checked Trade-Off Analyses
         if self.obj2.get() != "None":
-            self.auto_to_obj(dest_dir)
+            self.warm_sweep(self.auto_to_obj, dest_dir)
         if self.breakdown.get() != "None":
             self.auto_to_src(dest_dir)
 
@@ -1935,17 +2360,17 @@ class UNWFPModel:
         if self.checkbox["Replace 1 Commodity"].get()==1:
             self.auto_adj_swap(dest_dir)
         if self.checkbox["Optimise Ration Sizes"].get()==1:
-            self.auto_adj_rat(dest_dir)
+            self.warm_sweep(self.auto_adj_rat, dest_dir)
         if self.checkbox["Adjust Transfer Modality"].get()==1:
-            self.auto_adj_cv(dest_dir)
+            self.warm_sweep(self.auto_adj_cv, dest_dir)
         if self.checkbox["Increase Prices"].get()==1:
-            self.auto_adj_proc(dest_dir)
+            self.warm_sweep(self.auto_adj_proc, dest_dir)
         if self.checkbox["Scale Up Operation"].get()==1:
-            self.auto_adj_scaleup(dest_dir)
+            self.warm_sweep(self.auto_adj_scaleup, dest_dir)
         if self.checkbox["Sourcing Breakdown"].get()==1:
             self.auto_adj_src(dest_dir)
         if self.checkbox["Adjust US-IK Funding"].get()==1:
-            self.auto_adj_ik(dest_dir)
+            self.warm_sweep(self.auto_adj_ik, dest_dir)
         if self.checkbox["Allocate Resources"].get()==1:
             print "The Allocate Resources analysis is currently on hold and will be available again in a future release."
             # self.auto_adj_shapley(dest_dir)
@@ -1965,13 +2390,25 @@ class UNWFPModel:
         print " "
         self.quick_load()
 
+    def warm_sweep(self, sweep, dest_dir):
+        '''
+        Runs an automated analysis in which each step starts from the solution of the previous step (see solver(self, prob))
+        '''
+
+        self.warmstart = 1
+        self.incumbent = {}
+        try:
+            sweep(dest_dir)
+        finally:
+            self.warmstart = 0 # also when a step fails, so that later scenarios are not handed a stale MIP start
+
     def auto_des_nvs(self, dest_dir):
         '''
         Automated analysis (design): Nutritional Value Score
         '''
 
         # set up
-        if self.prepped != [self.tstart.get(),self.tend.get(),self.useforecasts.get()]: # the general constraints have not been set yet for the current time horizon
+        if self.prepped != self.prep_key(): # the general constraints have not been set yet for the current time horizon
             self.prep()
         sub_dir = os.path.join(dest_dir, 'NVS Scenarios')
         bmcopy = self.solutions.copy()
@@ -1993,7 +2430,7 @@ class UNWFPModel:
                         self.maxgoal["Nutritional Value Score",self.horizon[t]] = 11
                 self.calculate(s)
                 self.analysis_count += 1
-                if self.status == "Optimal":
+                if self.status in self.SOLVED:
                     self.csv_outputs(os.path.join(sub_dir,s),s)
                 else:
                     self.infeas.append([s,self.status])
@@ -2001,6 +2438,7 @@ class UNWFPModel:
 
         # wrap up
         self.csv_benchmarks(sub_dir, "NVS Scenarios")
+        self.csv_profile(sub_dir)
         bmcopy.update(self.solutions) # Adds items from self.solutions to bmcopy. In case scenario names overlap, those from self.solutions overwrite older scenarios
         self.solutions = bmcopy.copy()
         self.quick_load()
@@ -2012,7 +2450,7 @@ class UNWFPModel:
         '''
 
         # set up
-        if self.prepped != [self.tstart.get(),self.tend.get(),self.useforecasts.get()]: # the general constraints have not been set yet for the current time horizon
+        if self.prepped != self.prep_key(): # the general constraints have not been set yet for the current time horizon
             self.prep()
         sub_dir = os.path.join(dest_dir, 'C&V Scenarios')
         bmcopy = self.solutions.copy()
@@ -2028,7 +2466,7 @@ class UNWFPModel:
                     self.user_cv_max.set(perc)
                 self.calculate(s)
                 self.analysis_count += 1
-                if self.status == "Optimal":
+                if self.status in self.SOLVED:
                     self.csv_outputs(os.path.join(sub_dir,s),s)
                 else:
                     self.infeas.append([s,self.status])
@@ -2036,6 +2474,7 @@ class UNWFPModel:
 
         # wrap up
         self.csv_benchmarks(sub_dir, "C&V Scenarios")
+        self.csv_profile(sub_dir)
         bmcopy.update(self.solutions) # Adds items from self.solutions to bmcopy. In case scenario names overlap, those from self.solutions overwrite older scenarios
         self.solutions = bmcopy.copy()
         self.quick_load()
@@ -2046,7 +2485,7 @@ class UNWFPModel:
         '''
 
         # set up
-        if self.prepped != [self.tstart.get(),self.tend.get(),self.useforecasts.get()]: # the general constraints have not been set yet for the current time horizon
+        if self.prepped != self.prep_key(): # the general constraints have not been set yet for the current time horizon
             self.prep()
         sub_dir = os.path.join(dest_dir, 'LT Scenarios')
         check, val = 0, 0
@@ -2062,7 +2501,7 @@ class UNWFPModel:
                     self.maxgoal["Lead Time","Total"] = days
                 self.calculate(s)
                 self.analysis_count += 1
-                if self.status == "Optimal":
+                if self.status in self.SOLVED:
                     self.csv_outputs(os.path.join(sub_dir,s),s)
                     check, val = 1, days
                 else:
@@ -2074,6 +2513,7 @@ class UNWFPModel:
 
         # wrap up
         self.csv_benchmarks(sub_dir, "LT Scenarios")
+        self.csv_profile(sub_dir)
         bmcopy.update(self.solutions) # Adds items from self.solutions to bmcopy. In case scenario names overlap, those from self.solutions overwrite older scenarios
         self.solutions = bmcopy.copy()
         self.quick_load()
@@ -2084,7 +2524,7 @@ class UNWFPModel:
         '''
 
         # set up
-        if self.prepped != [self.tstart.get(),self.tend.get(),self.useforecasts.get()]: # the general constraints have not been set yet for the current time horizon
+        if self.prepped != self.prep_key(): # the general constraints have not been set yet for the current time horizon
             self.prep()
         s = self.obj2.get()
         sub_dir = os.path.join(dest_dir, "(TO) " + s)
@@ -2116,7 +2556,7 @@ class UNWFPModel:
                         self.maxgoal["Nutritional Value Score",self.horizon[t]] = maxval
                 self.calculate(name2)
                 self.analysis_count += 1
-                if self.status == "Optimal":
+                if self.status in self.SOLVED:
                     self.csv_outputs(os.path.join(sub_dir,name2),name2)
                     check = 1
                 else:
@@ -2137,7 +2577,7 @@ class UNWFPModel:
                 self.maxgoal["Nutritional Value Score","Average"] = val
                 self.calculate(name2)
                 self.analysis_count += 1
-                if self.status == "Optimal":
+                if self.status in self.SOLVED:
                     self.csv_outputs(os.path.join(sub_dir,name2),name2)
                     check = 1
                 else:
@@ -2160,7 +2600,7 @@ class UNWFPModel:
                 self.maxgoal["Nutritional Value Score","Average"] = val/100.0*11
                 self.calculate(name2)
                 self.analysis_count += 1
-                if self.status == "Optimal":
+                if self.status in self.SOLVED:
                     self.csv_outputs(os.path.join(sub_dir,name2),name2)
                     check = 1
                 else:
@@ -2185,7 +2625,7 @@ class UNWFPModel:
                 self.maxgoal["Energy Supplied [Total]","Average"] = val
                 self.calculate(name2)
                 self.analysis_count += 1
-                if self.status == "Optimal":
+                if self.status in self.SOLVED:
                     self.csv_outputs(os.path.join(sub_dir,name2),name2)
                     check = 1
                 else:
@@ -2207,7 +2647,7 @@ class UNWFPModel:
                 self.user_cv_max.set(str(val))
                 self.calculate(name2)
                 self.analysis_count += 1
-                if self.status == "Optimal":
+                if self.status in self.SOLVED:
                     self.csv_outputs(os.path.join(sub_dir,name2),name2)
                     check = 1
                 else:
@@ -2229,7 +2669,7 @@ class UNWFPModel:
                 self.user_loc_max.set(str(val))
                 self.calculate(name2)
                 self.analysis_count += 1
-                if self.status == "Optimal":
+                if self.status in self.SOLVED:
                     self.csv_outputs(os.path.join(sub_dir,name2),name2)
                     check = 1
                 else:
@@ -2251,7 +2691,7 @@ class UNWFPModel:
                 self.maxgoal["Lead Time","Average"] = val
                 self.calculate(name2)
                 self.analysis_count += 1
-                if self.status == "Optimal":
+                if self.status in self.SOLVED:
                     self.csv_outputs(os.path.join(sub_dir,name2),name2)
                     check = 1
                 else:
@@ -2272,7 +2712,7 @@ class UNWFPModel:
                 self.maxgoal["Lead Time","Total"] = val
                 self.calculate(name2)
                 self.analysis_count += 1
-                if self.status == "Optimal":
+                if self.status in self.SOLVED:
                     self.csv_outputs(os.path.join(sub_dir,name2),name2)
                 else:
                     self.infeas.append([name2,self.status])
@@ -2281,6 +2721,7 @@ class UNWFPModel:
         # wrap up
         self.quick_load()
         self.csv_benchmarks(sub_dir,name[:-3])
+        self.csv_profile(sub_dir)
         self.obj2.set("None")
         bmcopy.update(self.solutions) # Adds items from self.solutions to bmcopy. In case scenario names overlap, those from self.solutions overwrite older scenarios
         self.solutions = bmcopy.copy()
@@ -2348,7 +2789,7 @@ class UNWFPModel:
                                     self.user_ex_cv[arc[1],arc[2]] = self.horizon
                     self.calculate(name)
                     self.analysis_count += 1
-                    if self.status == "Optimal":
+                    if self.status in self.SOLVED:
                         self.csv_outputs("\\\\?\\" + os.path.join(sub_dir,name),name)
                         if abs(best - value(self.TC["Total"])) < 10:
                             self.solutions.pop("Optimal sourcing for " + k,None) # Only show optimal solution in the output when it does not overlap with a single-source solution
@@ -2357,6 +2798,7 @@ class UNWFPModel:
                         print " "
             # wrap up
             self.csv_benchmarks(sub_dir, "(TO) Sourcing (" + g + ")")
+            self.csv_profile(sub_dir)
             bmcopy.update(self.solutions)
             self.solutions = bmcopy.copy()
         else: # Run analysis for all food groups
@@ -2408,7 +2850,7 @@ class UNWFPModel:
                                         self.user_ex_cv[arc[1],arc[2]] = self.horizon
                         self.calculate(name)
                         self.analysis_count += 1
-                        if self.status == "Optimal":
+                        if self.status in self.SOLVED:
                             self.csv_outputs("\\\\?\\" + os.path.join(subsub_dir,name),name)
                             if abs(value(self.TC["Total"]) - best) < 10:
                                 self.solutions.pop("Optimal sourcing for " + k,None) # Only show optimal solution in the output when it does not overlap with a single-source solution
@@ -2417,10 +2859,12 @@ class UNWFPModel:
                             print " "
                 # wrap up the food group
                 self.csv_benchmarks(subsub_dir, "(TO) Sourcing (" + fg + ")")
+                self.csv_profile(subsub_dir)
                 bmcopy2.update(self.solutions)
                 self.solutions = bmcopy2.copy()
             # wrap up the 'All' analysis
             self.csv_benchmarks(sub_dir, "(TO) Sourcing (All)")
+            self.csv_profile(sub_dir)
             bmcopy.update(self.solutions)
             self.solutions = bmcopy.copy()
 
@@ -2444,7 +2888,7 @@ class UNWFPModel:
         name = self.baseline.get()
         self.calculate(name)
         self.analysis_count += 1
-        if self.status == "Optimal":
+        if self.status in self.SOLVED:
             self.csv_outputs(os.path.join(sub_dir,name),name)
         self.allowshortfalls.set(1)
         self.sensible.set(0)
@@ -2459,13 +2903,14 @@ class UNWFPModel:
             name = "Remove " + k
             self.calculate(name)
             self.analysis_count += 1
-            if self.status == "Optimal":
+            if self.status in self.SOLVED:
                 self.csv_outputs(os.path.join(sub_dir,name),name)
             else:
                 self.infeas.append([name,self.status])
 
         # wrap up
         self.csv_benchmarks(sub_dir, "Remove 1 Commodity")
+        self.csv_profile(sub_dir)
         self.remove = ""
         bmcopy.update(self.solutions) # Adds items from self.solutions to bmcopy. In case scenario names overlap, those from self.solutions overwrite older scenarios
         self.solutions = bmcopy.copy()
@@ -2487,7 +2932,7 @@ class UNWFPModel:
         name = self.baseline.get()
         self.calculate(name)
         self.analysis_count += 1
-        if self.status == "Optimal":
+        if self.status in self.SOLVED:
             self.csv_outputs(os.path.join(sub_dir,name),name)
         self.allowshortfalls.set(1)
         self.sensible.set(0)
@@ -2512,13 +2957,14 @@ class UNWFPModel:
                     name = "Swap " + k1 + " with " + k2
                     self.calculate(name)
                     self.analysis_count += 1
-                    if self.status == "Optimal":
+                    if self.status in self.SOLVED:
                         self.csv_outputs(os.path.join(sub_dir,name),name)
                     else:
                         self.infeas.append([name,self.status])
 
         # wrap up
         self.csv_benchmarks(sub_dir, "Replace 1 Commodity")
+        self.csv_profile(sub_dir)
         self.replace = []
         bmcopy.update(self.solutions) # Adds items from self.solutions to bmcopy. In case scenario names overlap, those from self.solutions overwrite older scenarios
         self.solutions = bmcopy.copy()
@@ -2540,7 +2986,7 @@ class UNWFPModel:
         name = self.baseline.get()
         self.calculate(name)
         self.analysis_count += 1
-        if self.status == "Optimal":
+        if self.status in self.SOLVED:
             self.csv_outputs(os.path.join(sub_dir,name),name)
         d = self.deviation.get()
         if d.endswith("%"):
@@ -2567,7 +3013,7 @@ class UNWFPModel:
                 name = "Optimised ration for " + str(nvs + .5*i) + " NVS"
             self.calculate(name)
             self.analysis_count += 1
-            if self.status == "Optimal":
+            if self.status in self.SOLVED:
                 self.csv_outputs(os.path.join(sub_dir,name),name)
                 check = 1
             else:
@@ -2578,6 +3024,7 @@ class UNWFPModel:
 
         # wrap up
         self.csv_benchmarks(sub_dir,"Optimise Ration Sizes")
+        self.csv_profile(sub_dir)
         self.ration = ""
         bmcopy.update(self.solutions) # Adds items from self.solutions to bmcopy. In case scenario names overlap, those from self.solutions overwrite older scenarios
         self.solutions = bmcopy.copy()
@@ -2599,7 +3046,7 @@ class UNWFPModel:
         name = self.baseline.get()
         self.calculate(name)
         self.analysis_count += 1
-        if self.status == "Optimal":
+        if self.status in self.SOLVED:
             self.csv_outputs(os.path.join(sub_dir,name),name)
         self.reset_ik()
         check = 0
@@ -2616,7 +3063,7 @@ class UNWFPModel:
             self.user_add_ik["USD","Percentage",self.horizon[0]] = i*5
             self.calculate(name)
             self.analysis_count += 1
-            if self.status == "Optimal":
+            if self.status in self.SOLVED:
                 self.csv_outputs(os.path.join(sub_dir,name),name)
                 check = 1
             else:
@@ -2627,6 +3074,7 @@ class UNWFPModel:
 
         # wrap up
         self.csv_benchmarks(sub_dir,"Adjust US-IK Funding")
+        self.csv_profile(sub_dir)
         bmcopy.update(self.solutions) # Adds items from self.solutions to bmcopy. In case scenario names overlap, those from self.solutions overwrite older scenarios
         self.solutions = bmcopy.copy()
         self.checkbox["Adjust US-IK Funding"].set(0)
@@ -2647,13 +3095,13 @@ class UNWFPModel:
         name = self.baseline.get()
         self.calculate(name)
         self.analysis_count += 1
-        if self.status == "Optimal":
+        if self.status in self.SOLVED:
             self.csv_outputs(os.path.join(sub_dir,name),name)
         self.reset_proc()
 
         # evaluate -50 to +100% loc/reg price increases, with increments of 10%
         for i in range(16):
-            self.prepped = ["","",""]
+            self.prepped = []
             l = ""
             if self.incr_loc.get()==1:
                 l += "loc "
@@ -2677,7 +3125,7 @@ class UNWFPModel:
             name = "Price " + l + str(-50+i*10) + "%"
             self.calculate(name)
             self.analysis_count += 1
-            if self.status == "Optimal":
+            if self.status in self.SOLVED:
                 self.csv_outputs(os.path.join(sub_dir,name),name)
                 check = 1
             else:
@@ -2685,6 +3133,7 @@ class UNWFPModel:
 
         # wrap up
         self.csv_benchmarks(sub_dir,"Increase Prices")
+        self.csv_profile(sub_dir)
         bmcopy.update(self.solutions) # Adds items from self.solutions to bmcopy. In case scenario names overlap, those from self.solutions overwrite older scenarios
         self.solutions = bmcopy.copy()
         self.checkbox["Increase Prices"].set(0)
@@ -2708,7 +3157,7 @@ class UNWFPModel:
         name = self.baseline.get()
         self.calculate(name)
         self.analysis_count += 1
-        if self.status == "Optimal":
+        if self.status in self.SOLVED:
             self.csv_outputs(os.path.join(sub_dir,name),name)
         self.totalmt = value(self.MT["Total"]) # if we don't specify the mt the tool will start buying more than we need just to get a high %-rate
         self.reset_proc()
@@ -2728,7 +3177,7 @@ class UNWFPModel:
             self.user_cv_max.set(str(i*5))
             self.calculate(name)
             self.analysis_count += 1
-            if self.status == "Optimal":
+            if self.status in self.SOLVED:
                 self.csv_outputs(os.path.join(sub_dir,name),name)
                 check = 1
             else:
@@ -2739,6 +3188,7 @@ class UNWFPModel:
 
         # wrap up
         self.csv_benchmarks(sub_dir,"Adjust Transfer Modality")
+        self.csv_profile(sub_dir)
         self.totalmt = ""
         bmcopy.update(self.solutions) # Adds items from self.solutions to bmcopy. In case scenario names overlap, those from self.solutions overwrite older scenarios
         self.solutions = bmcopy.copy()
@@ -2760,7 +3210,7 @@ class UNWFPModel:
         name = self.baseline.get()
         self.calculate(name)
         self.analysis_count += 1
-        if self.status == "Optimal":
+        if self.status in self.SOLVED:
             self.csv_outputs(os.path.join(sub_dir,name),name)
         check = 0
 
@@ -2776,7 +3226,7 @@ class UNWFPModel:
             self.scaleup = 1 + i*5/100.0
             self.calculate(name)
             self.analysis_count += 1
-            if self.status == "Optimal":
+            if self.status in self.SOLVED:
                 self.csv_outputs(os.path.join(sub_dir,name),name)
                 check = 1
             else:
@@ -2787,6 +3237,7 @@ class UNWFPModel:
 
         # wrap up
         self.csv_benchmarks(sub_dir, "Scale Up Operation")
+        self.csv_profile(sub_dir)
         self.scaleup = 1
         bmcopy.update(self.solutions) # Adds items from self.solutions to bmcopy. In case scenario names overlap, those from self.solutions overwrite older scenarios
         self.solutions = bmcopy.copy()
@@ -2853,7 +3304,7 @@ class UNWFPModel:
                                 self.user_ex_cv[arc[1],arc[2]] = self.horizon
                 self.calculate(name)
                 self.analysis_count += 1
-                if self.status == "Optimal":
+                if self.status in self.SOLVED:
                     self.csv_outputs("\\\\?\\" + os.path.join(sub_dir,name),name)
                     if abs(best - value(self.TC["Total"])) < 10:
                         self.solutions.pop("Optimal sourcing for " + k,None) # Only show optimal solution in the output when it does not overlap with a single-source solution
@@ -2863,6 +3314,7 @@ class UNWFPModel:
 
         # wrap up
         self.csv_benchmarks(sub_dir, "Sourcing Breakdown")
+        self.csv_profile(sub_dir)
         bmcopy.update(self.solutions) # Adds items from self.solutions to bmcopy. In case scenario names overlap, those from self.solutions overwrite older scenarios
         self.solutions = bmcopy.copy()
         self.checkbox["Sourcing Breakdown"].set(0)
@@ -2912,13 +3364,14 @@ class UNWFPModel:
                 self.activities.append(ss)
             self.calculate(name)
             self.analysis_count += 1
-            if self.status == "Optimal":
+            if self.status in self.SOLVED:
                 self.csv_outputs(os.path.join(sub_dir,name),name)
             else:
                 self.infeas.append([name,self.status])
 
         # wrap up
         self.csv_benchmarks(sub_dir,"Allocate Resources")
+        self.csv_profile(sub_dir)
         bmcopy.update(self.solutions) # Adds items from self.solutions to bmcopy. In case scenario names overlap, those from self.solutions overwrite older scenarios
         self.solutions = bmcopy.copy()
         self.checkbox["Allocate Resources"].set(0)
@@ -2936,7 +3389,7 @@ class UNWFPModel:
         self.csvnamel.set(name)
         self.csv_load()
         self.calculate(name)
-        if self.status == "Optimal":
+        if self.status in self.SOLVED:
             self.csv_outputs(os.path.join(sub_dir,name),name)
 
         # create all subsets
@@ -2963,13 +3416,14 @@ class UNWFPModel:
                     self.food2fix.append((i,33.33+b*6.67))
                     name+= " " + abr[i]
                 self.calculate(name)
-                if self.status == "Optimal":
+                if self.status in self.SOLVED:
                     self.csv_outputs(os.path.join(sub_dir,name),name)
                 else:
                     self.infeas.append([name,self.status])
 
         # wrap up
         self.csv_benchmarks(sub_dir,"PRRO Analysis")
+        self.csv_profile(sub_dir)
 
     def listanalysis(self):
         '''
@@ -3016,6 +3470,43 @@ class UNWFPModel:
         self.quick_load()
         self.close(self.scenwin)
 
+    def run_scenarios(self, names):
+        '''
+        Runs a series of saved scenarios sequentially without the GUI (used by the command line)
+        Returns the amount of scenarios that could not be solved
+        '''
+
+        print "Starting scenario analysis from command line:"
+        for s in names:
+            print "> " + s
+        print " "
+        tick = time.time()
+        n = 0
+        e = 0
+        for s in names:
+            try:
+                print "Processing scenario: " + s
+                self.csvnamel.set(s)
+                self.csv_load()
+                self.scenname.set(s)
+                self.objset()
+                if self.status not in self.SOLVED:
+                    e += 1
+                n += 1
+            except:
+                print "<<<ERROR>>> Failed to solve scenario " + s
+                traceback.print_exc(file=sys.stdout)
+                e += 1
+
+        tack = time.time()
+        print "Analysed " + str(n) + " scenarios in " + self.fmt_wcommas(tack-tick)[1:] + " seconds"
+        if e > 0:
+            print "<<<WARNING>>> " + str(e) + " scenarios could not be solved"
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        dest_dir = os.path.join(script_dir, 'output')
+        self.csv_benchmarks(dest_dir,"Command Line")
+        return e
+
     def include_com(self):
         '''
         User-added constraint: Include commodity
@@ -3940,10 +4431,23 @@ class UNWFPModel:
         c.writerow(["user_nut_maxfat",self.user_nut_maxfat.get()])
         out.close()
 
+        path = os.path.join(dest_dir, "solver settings.csv")
+        out = open(path,"wb")
+        c = csv.writer(out, dialect='excel')
+        c.writerow(["backend",self.solver_backend.get()])
+        c.writerow(["threads",self.solver_threads.get()])
+        c.writerow(["gaprel",self.solver_gaprel.get()])
+        c.writerow(["gapabs",self.solver_gapabs.get()])
+        c.writerow(["time",self.solver_time.get()])
+        c.writerow(["presolve",self.solver_presolve.get()])
+        c.writerow(["cuts",self.solver_cuts.get()])
+        out.close()
+
         print "User constraints saved to "+dest_dir
         print " "
         self.scenname.set(name)
-        self.update_csv()  # update the load csv menu
+        if self.gui:
+            self.update_csv()  # update the load csv menu
 
     def csv_load(self):
         '''
@@ -4001,17 +4505,18 @@ class UNWFPModel:
         except:
             print "<<<Error>>> Could not load activities.csv"
             e += 1
-        self.listbox_act.delete(0,END)
-        for b in self.beneficiaries:
-            if b == self.ben.get():
-                continue
-            self.listbox_act.insert(END,b)
-        for i in range(self.listbox_act.size()):
-            if self.listbox_act.get(i) in self.activities:
-                self.listbox_act.itemconfig(i, background="light sky blue")
-            else:
-                self.listbox_act.itemconfig(i, background="white")
-        self.act_button.configure(text="Select (" + str(len(self.activities)) + ")")
+        if self.gui:
+            self.listbox_act.delete(0,END)
+            for b in self.beneficiaries:
+                if b == self.ben.get():
+                    continue
+                self.listbox_act.insert(END,b)
+            for i in range(self.listbox_act.size()):
+                if self.listbox_act.get(i) in self.activities:
+                    self.listbox_act.itemconfig(i, background="light sky blue")
+                else:
+                    self.listbox_act.itemconfig(i, background="white")
+            self.act_button.configure(text="Select (" + str(len(self.activities)) + ")")
 
         try:
             path = os.path.join(dest_dir, "user_add_com.csv")
@@ -4301,6 +4806,8 @@ class UNWFPModel:
             print "<<<Error>>> Could not load tactical_demand.csv"
             e += 1
 
+        e += self.csv_load_solver(dest_dir)
+
         self.scenname.set(name)
         self.csvnames.set(name)
 
@@ -4310,6 +4817,31 @@ class UNWFPModel:
             print str(e) + " errors encountered during loading of " + name
         print " "
 
+    def csv_load_solver(self, dest_dir):
+        '''
+        Load the solver settings of a scenario (see csv_save(self)), returns the number of errors
+        Scenarios saved before the solver settings were introduced keep the defaults (see reset_solver(self))
+        '''
+
+        path = os.path.join(dest_dir, "solver settings.csv")
+        if not os.path.isfile(path):
+            return 0
+        try:
+            out = open(path,"rb")
+            c = csv.reader(out, dialect='excel')
+            self.solver_backend.set(c.next()[1])
+            self.solver_threads.set(c.next()[1])
+            self.solver_gaprel.set(c.next()[1])
+            self.solver_gapabs.set(c.next()[1])
+            self.solver_time.set(c.next()[1])
+            self.solver_presolve.set(c.next()[1])
+            self.solver_cuts.set(c.next()[1])
+            out.close()
+        except:
+            print "<<<Error>>> Could not load 'solver settings.csv'"
+            return 1
+        return 0
+
     def csv_load_old(self):
         '''
         Load user input from .csv file using previous methodology (for conversion)
@@ -4657,6 +5189,8 @@ class UNWFPModel:
             print "<<<Error>>> Could not load exp_pattern.csv"
             e += 1
 
+        e += self.csv_load_solver(dest_dir) # NB: kept as is by csv_convert(self)
+
         self.scenname.set(name)
         self.csvnames.set(name)
 
@@ -4675,12 +5209,10 @@ class UNWFPModel:
         > Statistics
         '''
 
-        NAME = NAME.replace('/','-') # /-signs create subfolders (occurs f.i. with "SORGHUM/MILLET")
-        NAME = NAME.replace('<','leq')
-        NAME = NAME.replace('>','geq')
-        LOC = LOC.replace('/','-') # /-signs create subfolders (occurs f.i. with "SORGHUM/MILLET")
-        LOC = LOC.replace('<','leq')
-        LOC = LOC.replace('>','geq')
+        if LOC.endswith(NAME): # LOC = output folder + scenario name
+            LOC = LOC[:len(LOC)-len(NAME)] + self.fmt_filename(NAME)
+            # NB: only the scenario name is sanitised, the rest of LOC is a real path (with /-signs on Linux)
+        NAME = self.fmt_filename(NAME)
         print "Writing output files..."
         try:
             os.makedirs(LOC) # create output folder
@@ -4906,6 +5438,31 @@ class UNWFPModel:
         except IOError:
             print "File is currently opened, please close it ;-)"
 
+    def csv_profile(self,LOC):
+        '''
+        Writes the profiling records (see record(self,PHASE,tick,NOTE)) to Profile.csv and Profile.json, and starts a new profile
+        The report covers all phases since the previous report (the first report also includes loading the data)
+        '''
+
+        try:
+            os.makedirs(LOC) # create output folder
+        except OSError:
+            pass # folder already exists
+        header = ["Phase","Wall Time (s)","Peak Memory (MB)","Objects","Notes"]
+        try:
+            out = open(os.path.join(LOC,"Profile.csv"), "wb")
+            c = csv.writer(out, dialect='excel')
+            c.writerow(header)
+            for row in self.profile:
+                c.writerow(row)
+            out.close()
+            out = open(os.path.join(LOC,"Profile.json"), "wb")
+            json.dump([dict(zip(header,row)) for row in self.profile], out, indent=1)
+            out.close()
+        except IOError:
+            print "Profile is currently opened, please close it ;-)"
+        self.profile = []
+
     def display_solution(self,VAR):
         '''
         Display variable values for last scenario
@@ -5226,6 +5783,122 @@ class UNWFPModel:
                     print " > Excluded: ", i
 
 
+    def init_headless(self):
+        '''
+        Initialises the user inputs without drawing the GUI.
+        Tkinter variables are replaced by Setting objects with the same defaults as the GUI,
+        so that scenarios can be loaded, solved, and written to file on machines without a display.
+        '''
+
+        self.gui = 0
+
+        # General user input (see draw_generalinput(self))
+        self.tstart = Setting(self.periods[0])
+        for t in self.periods:
+            if sum(self.dem[b,t] for b in self.beneficiaries) > 0:
+                p = t
+                break
+        self.tend = Setting(p)
+        i = 0
+        m = self.dem[self.benlist[i], p]
+        for b in self.benlist:
+            if self.dem[b,p] > m :
+                m = self.dem[b,p]
+                i = self.benlist.index(b) # the default activity is the one with the biggest demand
+        self.ben = Setting(self.benlist[i])
+        self.allowshortfalls = Setting(0,int)
+        self.sensible = Setting(1,int)
+        self.useforecasts = Setting(1,int)
+        self.supply_tact = Setting(0,int)
+        self.varbasket = Setting("Variable")
+        self.modality = Setting("Voucher")
+        self.activities = []
+
+        # Food basket (see draw_fixfood(self) and draw_editfood(self))
+        self.food2fix = []
+        self.fix_com = {}
+        self.fix_quant = {}
+        for i in range (0,15):
+            self.fix_com[i] = Setting("Select")
+            self.fix_quant[i] = Setting("N/A")
+        self.user_ex_com = []
+        self.user_add_nut = {}
+        self.user_add_fg = {}
+        self.user_ex_fg = []
+        self.user_add_mincom = Setting("N/A")
+        self.user_add_maxcom = Setting("N/A")
+        self.user_nut_minprot = Setting("0")
+        self.user_nut_maxprot = Setting("100")
+        self.user_nut_minfat = Setting("0")
+        self.user_nut_maxfat = Setting("100")
+        self.gmo = Setting(1,int)
+
+        # Procurement and routing (see draw_procurement(self) and draw_routing(self))
+        self.user_ex_proc_int = {}
+        self.user_ex_proc_loc = {}
+        self.user_add_proc_int = {}
+        self.user_add_proc_loc = {}
+        self.user_int_min = Setting("0")
+        self.user_int_max = Setting("100")
+        self.user_reg_min = Setting("0")
+        self.user_reg_max = Setting("100")
+        self.user_loc_min = Setting("0")
+        self.user_loc_max = Setting("100")
+        self.user_ex_route = {}
+        self.user_add_route = {}
+        self.user_cap_util = {}
+        self.user_cap_aloc = {}
+
+        # C&V, objectives, and funding (see draw_CV(self), draw_obj(self) and draw_funding(self))
+        self.user_add_cv = {}
+        self.user_ex_cv = {}
+        self.user_modality = {}
+        self.user_cv_min = Setting("0")
+        self.user_cv_max = Setting("100")
+        self.exp_pattern = {}
+        self.exp_pattern["Cereals and Grains",0] = Setting(20)
+        self.exp_pattern["Cereals and Grains",1] = Setting(40)
+        self.exp_pattern["Vegetables and Fruits",0] = Setting(15)
+        self.exp_pattern["Vegetables and Fruits",1] = Setting(30)
+        self.exp_pattern["Other Food Items",0] = Setting(0)
+        self.exp_pattern["Other Food Items",1] = Setting(25)
+        self.exp_pattern["Non-Food Items",0] = Setting(10)
+        self.exp_pattern["Non-Food Items",1] = Setting(50)
+        self.mingoal = {}
+        self.maxgoal = {}
+        self.user_add_ik = {}
+
+        # Solver settings (see draw_solveropts(self))
+        self.solver_backend = Setting("Default")
+        self.solver_threads = Setting("N/A")
+        self.solver_gaprel = Setting("N/A")
+        self.solver_gapabs = Setting("N/A")
+        self.solver_time = Setting("N/A")
+        self.solver_presolve = Setting("Default")
+        self.solver_cuts = Setting("Default")
+
+        # Tactical demand filters (see draw_tact(self))
+        self.tactboxes = {}
+        for i in (self.tact_fdp.keys() + self.tact_com.keys() + self.tact_mon.keys()):
+            self.tactboxes[i] = Setting(1,int)
+
+        # Save/load, scenario analysis, and outputs (see draw_save(self), draw_analysis(self) and draw_outputs(self))
+        self.csvnames = Setting("filename")
+        self.csvnamel = Setting("Select")
+        self.countscen = 1
+        self.prepped = []
+        self.scenname = Setting("Scenario_001")
+        self.solutions = {}
+        self.disp = {}
+
+        # Automated analyses (see draw_auto(self))
+        self.remove = ""
+        self.replace = []
+        self.ration = ""
+        self.totalmt = ""
+        self.mod_loc, self.mod_reg, self.mod_cbt = 1, 1, 1
+        self.scaleup = 1
+
     def draw_GUI(self,root):
         '''
         Draws the GUI and initialises all the windows
@@ -5285,6 +5958,7 @@ class UNWFPModel:
         self.draw_outputs()
         self.draw_auto()
         self.draw_tact()
+        self.draw_solveropts()
         self.draw_solution()
         self.draw_stdout()
         self.draw_scenlist()
@@ -6150,7 +6824,7 @@ class UNWFPModel:
         '''
 
         self.countscen = 1 # Keeps track of the scenarios
-        self.prepped = ["","",""] # Used to check whether the constraints are prepared for the right time interval
+        self.prepped = [] # Used to check whether the constraints are prepared for the right time interval
         r,c = 5,5
         ttk.Label(self.frame_main, text = "Scenario Analysis:", font = ("Helvetica",11,"bold"), anchor=CENTER).grid(row=r,column=c,columnspan=3,sticky=EW)
         self.scenname = StringVar()
@@ -6165,6 +6839,9 @@ class UNWFPModel:
         b = ttk.Button(self.frame_main, text = "Scenario Analysis (Auto)", command = lambda: self.show(self.autowin))
         b.grid(row=r+2,column=c+2,sticky=EW)
         createToolTip(b,"Access a range of automated analyses to gain some quick insights")
+        b = ttk.Button(self.frame_main, text = "Solver Settings", command = lambda: self.show(self.solverwin))
+        b.grid(row=r+3,column=c,columnspan=3,sticky=EW)
+        createToolTip(b,"Choose the solver, threads, MIP gap and time limit\n(saved with the scenario, also used by the automated analyses)")
 
     def draw_outputs(self):
         '''
@@ -6252,6 +6929,53 @@ class UNWFPModel:
         ttk.Label(self.tactwin, text = "   ").grid(row=0,column=8,sticky=EW)
         self.tactwin.withdraw()
 
+    def draw_solveropts(self):
+        '''
+        Draws GUI component: Solver settings (see solver(self, prob))
+        '''
+
+        self.solverwin = Toplevel(background=self.bgcolor,padx=20,pady=20)
+        self.solverwin.protocol('WM_DELETE_WINDOW', lambda: self.close(self.solverwin))
+        ttk.Label(self.solverwin, text = "Solver Settings", font=("Helvetica",11,"bold")).grid(row=0,column=0,columnspan=2,sticky=W,pady=(0,5))
+
+        self.solver_backend = StringVar()
+        l = ttk.Label(self.solverwin, text = "Solver")
+        l.grid(row=1,column=0,sticky=W)
+        choices = ["Default"] + sorted(self.backends().keys())
+        ttk.OptionMenu(self.solverwin, self.solver_backend, choices[0], *choices).grid(row=1,column=1,sticky=EW)
+        t = ("Only the solvers installed on this machine are listed."
+            "\nDefault = CBC (the one that comes with PuLP, unless another CBC is installed),"
+            "\nwhich is handed the model through a pipe rather than a file.")
+        createToolTip(l,t)
+
+        self.solver_threads = StringVar()
+        self.solver_gaprel = StringVar()
+        self.solver_gapabs = StringVar()
+        self.solver_time = StringVar()
+        r = 2
+        for var, text, tip in [[self.solver_threads, "Threads", "Number of threads used by the solver (CBC, HiGHS)"],
+                               [self.solver_gaprel, "Relative MIP Gap", "Stop when the solution is within this fraction of the optimum\ne.g. 0.01 = within 1%"],
+                               [self.solver_gapabs, "Absolute MIP Gap", "Stop when the solution is within this amount (USD) of the optimum (CBC, HiGHS)"],
+                               [self.solver_time, "Time Limit (s)", "Stop after this many seconds and use the best solution found so far"]]:
+            var.set("N/A")
+            l = ttk.Label(self.solverwin, text = text)
+            l.grid(row=r,column=0,sticky=W)
+            ttk.Entry(self.solverwin, textvariable = var, justify=CENTER).grid(row=r,column=1,sticky=EW)
+            createToolTip(l,tip + "\nN/A = solver default")
+            r += 1
+
+        self.solver_presolve = StringVar()
+        self.solver_cuts = StringVar()
+        for var, text in [[self.solver_presolve, "Presolve"], [self.solver_cuts, "Cuts"]]:
+            ttk.Label(self.solverwin, text = text).grid(row=r,column=0,sticky=W)
+            ttk.OptionMenu(self.solverwin, var, "Default", *["Default","On","Off"]).grid(row=r,column=1,sticky=EW)
+            r += 1
+
+        ttk.Label(self.solverwin, text = " ").grid(row=r,column=0,sticky=W)
+        ttk.Button(self.solverwin, text = "Reset", command = self.reset_solver).grid(row=r+1,column=0,sticky=EW)
+        ttk.Button(self.solverwin, text = "Back", command = lambda: self.close(self.solverwin)).grid(row=r+1,column=1,sticky=EW)
+        self.solverwin.withdraw()
+
     def draw_auto(self):
         '''
         Draws GUI component: Pop-up window with automated analyses
@@ -6543,7 +7267,8 @@ class UNWFPModel:
 
         self.food2fix = []
         for i in range(0,15):
-            self.fix_spec[i].set("Filter")
+            if self.gui:
+                self.fix_spec[i].set("Filter")
             self.fix_com[i].set("Select")
             self.fix_quant[i].set("N/A")
 
@@ -6556,10 +7281,11 @@ class UNWFPModel:
         self.user_ex_route = {}
         self.user_cap_util = {}
         self.user_cap_aloc = {}
-        self.route_util_min.set("0")
-        self.route_util_max.set("100")
-        self.route_aloc_min.set("0")
-        self.route_aloc_max.set("100")
+        if self.gui:
+            self.route_util_min.set("0")
+            self.route_util_max.set("100")
+            self.route_aloc_min.set("0")
+            self.route_aloc_max.set("100")
 
     def reset_proc(self):
         '''
@@ -6609,14 +7335,15 @@ class UNWFPModel:
         self.user_modality = {}
         self.user_cv_min.set("0")
         self.user_cv_max.set("100")
-        self.cv_add_src.set("Select")
-        self.cv_add_com.set("Select")
-        self.cv_add_mt.set("N/A")
-        self.cv_ex_src.set("Select")
-        self.cv_ex_com.set("Select")
-        self.cv_mod_fdp.set("Select")
-        self.cv_mod_min.set("0")
-        self.cv_mod_max.set("100")
+        if self.gui:
+            self.cv_add_src.set("Select")
+            self.cv_add_com.set("Select")
+            self.cv_add_mt.set("N/A")
+            self.cv_ex_src.set("Select")
+            self.cv_ex_com.set("Select")
+            self.cv_mod_fdp.set("Select")
+            self.cv_mod_min.set("0")
+            self.cv_mod_max.set("100")
         self.exp_pattern["Cereals and Grains",0].set(20)
         self.exp_pattern["Cereals and Grains",1].set(40)
         self.exp_pattern["Vegetables and Fruits",0].set(15)
@@ -6632,7 +7359,8 @@ class UNWFPModel:
         '''
 
         self.user_add_ik = {}
-        self.ik_donation.set("N/A")
+        if self.gui:
+            self.ik_donation.set("N/A")
 
     def reset_obj(self):
         '''
@@ -6640,10 +7368,22 @@ class UNWFPModel:
         '''
 
         self.mingoal = {}
-        self.minstat.set("N/A")
-        self.maxstat.set("N/A")
-        self.statrange.set("Selected months")
         self.maxgoal = {}
+        if self.gui:
+            self.minstat.set("N/A")
+            self.maxstat.set("N/A")
+            self.statrange.set("Selected months")
+
+    def reset_solver(self):
+        '''
+        Reset solver settings
+        '''
+
+        self.solver_backend.set("Default")
+        for var in [self.solver_threads, self.solver_gaprel, self.solver_gapabs, self.solver_time]:
+            var.set("N/A")
+        self.solver_presolve.set("Default")
+        self.solver_cuts.set("Default")
 
     def reset(self):
         '''
@@ -6666,6 +7406,7 @@ class UNWFPModel:
             self.tactboxes[i].set(1)
         self.varbasket.set("Variable")
         self.modality.set("Voucher")
+        self.reset_solver()
         print "-- Constraints Reset --"
         print " "
 
@@ -6696,6 +7437,47 @@ class UNWFPModel:
 
         window.withdraw()
 
+    def record(self,PHASE,tick,NOTE=""):
+        '''
+        Profiling: Records the wall time since tick, the peak memory use (MB) and the number of Python objects at the end of a phase (plus an optional note)
+        Returns the current time, so that the next phase can be timed from here
+        '''
+
+        dur = time.time()-tick
+        self.profile.append([PHASE, dur, self.peak_memory(), len(gc.get_objects()), NOTE])
+        return time.time()
+
+    def peak_memory(self):
+        '''
+        Profiling: Returns the peak memory use of the process (MB), or "N/A" if it cannot be measured on this platform
+        '''
+
+        if resource is not None:
+            if sys.platform == "darwin":
+                return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1048576.0 # NB: ru_maxrss is in bytes (Mac)
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0 # NB: ru_maxrss is in kB (Linux)
+        if os.name == "nt":
+            try:
+                counters = ProcessMemoryCounters()
+                counters.cb = ctypes.sizeof(counters)
+                process = ctypes.windll.kernel32.GetCurrentProcess
+                process.restype = ctypes.c_void_p # NB: handles are 64 bits on 64-bit Windows
+                info = ctypes.windll.psapi.GetProcessMemoryInfo
+                info.argtypes = [ctypes.c_void_p, ctypes.POINTER(ProcessMemoryCounters), ctypes.c_ulong]
+                if info(process(), ctypes.byref(counters), counters.cb):
+                    return counters.PeakWorkingSetSize/1048576.0
+            except (AttributeError, OSError):
+                pass # psapi not available
+        return "N/A"
+
+    def update_idle(self):
+        '''
+        GUI: Redraw the output window while the model is working (skipped when running without GUI)
+        '''
+
+        if self.gui:
+            self.frame_right.update_idletasks()
+
     def update_conversion(self, *args):
         '''
         Update: Conversion table (in fixed food basket window)
@@ -7480,6 +8262,16 @@ class UNWFPModel:
         except: # i had only 1 digit
             self.filter = int(args[0][-1:])
 
+    def fmt_filename(self,NAME):
+        '''
+        Returns the scenario name as it is used for output folders and files
+        '''
+
+        NAME = NAME.replace('/','-') # /-signs create subfolders (occurs f.i. with "SORGHUM/MILLET")
+        NAME = NAME.replace('<','leq')
+        NAME = NAME.replace('>','geq')
+        return NAME
+
     def fmt_wcommas(self,amount):
         '''
         This function returns the input number with a $#,###.## format
@@ -7554,43 +8346,30 @@ class UNWFPModel:
 
     def xldate2month(self, DATE, TYPE):
         '''
-        This function converts an Excel date to a month name (MMM)
-        '''
-
-        d = datetime.datetime(1899, 12, 30) + datetime.timedelta(days=DATE)
-        s = d.isoformat() # "YYYY-MM-DD" + "T00:00:00"
-        i = s[5:7]
-        if i == "01":
-            m = "Jan"
-        elif i == "02":
-            m = "Feb"
-        elif i == "03":
-            m = "Mar"
-        elif i == "04":
-            m = "Apr"
-        elif i == "05":
-            m = "May"
-        elif i == "06":
-            m = "Jun"
-        elif i == "07":
-            m = "Jul"
-        elif i == "08":
-            m = "Aug"
-        elif i == "09":
-            m = "Sep"
-        elif i == "10":
-            m = "Oct"
-        elif i == "11":
-            m = "Nov"
-        elif i == "12":
-            m = "Dec"
-        else:
-            m = "Something went wrong :("
-        i = s[2:4]
-        if TYPE==0:
-            return m
-        else:
-            return m + "-" + i
+        This function converts an Excel date to a month name (MMM), or to a period name (MMM-YY) if TYPE != 0
+        The conversions are memoised per day, because the same dates recur throughout the data
+        '''
+
+        key = (int(DATE), TYPE != 0) # NB: The time of day doesn't affect the month
+        if key not in self.XLDATES:
+            d = datetime.date(1899, 12, 30) + datetime.timedelta(days=key[0])
+            m = self.MONTHS[d.month-1]
+            if TYPE==0:
+                self.XLDATES[key] = m
+            else:
+                self.XLDATES[key] = m + "-" + d.isoformat()[2:4]
+        return self.XLDATES[key]
+
+    def xldates2months(self, DATES, TYPE):
+        '''
+        Converts a column of Excel dates to month names (see xldate2month(self, DATE, TYPE))
+        Each distinct date is only converted once
+        '''
+
+        months = {}
+        for DATE in set(DATES):
+            months[DATE] = self.xldate2month(DATE, TYPE)
+        return [months[DATE] for DATE in DATES]
 
 class ToolTip(object):
 
@@ -7661,6 +8440,200 @@ class TextRedirector2(object):
     def write(self,str):
         None
 
+class Setting(object):
+    """stand-in for Tkinter's StringVar/IntVar when running without GUI"""
+    def __init__(self, value="", cast=str):
+        self.cast = cast
+        self.value = cast(value)
+    def get(self):
+        return self.value
+    def set(self, value):
+        self.value = self.cast(value)
+    def trace(self, *args):
+        None
+
+class SparseRows(object):
+    """constraint matrix in coordinate form: entry n puts val[n] * col[n] (a variable) in row row[n]"""
+    def __init__(self, zero=None):
+        self.zero = zero # variable fixed at 0 (terms with it are left out)
+        self.row = []
+        self.col = []
+        self.val = []
+        self.sense = [] # LpConstraintLE, LpConstraintGE or LpConstraintEQ per row
+        self.rhs = []
+        self.start = [] # first entry of each row (rows are added in one go, so their entries are consecutive)
+        self.tag = [] # e.g. the period a row belongs to
+    def add(self, terms, sense, rhs=0, tag=None):
+        r = len(self.sense)
+        self.start.append(len(self.val))
+        seen = {}
+        for v, c in terms: # terms = iterable of (variable, coefficient)
+            if v is self.zero:
+                continue
+            if v in seen:
+                self.val[seen[v]] += c # same variable twice in a row: coefficients are summed (as lpSum would)
+            else:
+                seen[v] = len(self.val)
+                self.row.append(r)
+                self.col.append(v)
+                self.val.append(c)
+        if not seen and ((sense == LpConstraintLE and rhs >= 0) or (sense == LpConstraintGE and rhs <= 0) or (sense == LpConstraintEQ and rhs == 0)):
+            self.start.pop() # nothing left but 0 (<=, >=, ==) rhs, which always holds
+            return
+        self.sense.append(sense)
+        self.rhs.append(rhs)
+        self.tag.append(tag)
+    def __len__(self):
+        return len(self.sense)
+    def constraints(self):
+        """one LpConstraint per row, filled straight from the coordinates (no intermediate expressions)"""
+        bounds = self.start + [len(self.val)]
+        return [LpConstraint(zip(self.col[bounds[r]:bounds[r+1]], self.val[bounds[r]:bounds[r+1]]), self.sense[r], rhs=self.rhs[r]) for r in range(len(self.sense))]
+    def add_to(self, prob):
+        """adds all rows to an LpProblem, returns the number of rows added"""
+        for con in self.constraints():
+            prob += con
+        return len(self.sense)
+
+class ArcIndex(object):
+    """arcs indexed on each of their fields, to find the arcs that match a user rule with "Any" wildcards"""
+    def __init__(self, fields):
+        self.fields = fields # e.g. ["origin","dest","com"]
+        self.arcs = []
+        self.index = dict((f,{}) for f in fields) # field -> value -> positions in self.arcs
+    def add(self, arc, values):
+        for f, v in zip(self.fields, values):
+            self.index[f].setdefault(v,[]).append(len(self.arcs))
+        self.arcs.append(arc)
+    def find(self, **query):
+        """arcs that match every field in query (in the order they were added); "Any" matches everything, a list matches any of its values"""
+        hits = None
+        for f, v in query.items():
+            if v == "Any":
+                continue
+            pos = set()
+            for val in (v if isinstance(v, list) else [v]):
+                pos.update(self.index[f].get(val,[]))
+            hits = pos if hits is None else hits & pos
+        if hits is None:
+            return list(self.arcs)
+        return [self.arcs[n] for n in sorted(hits)]
+
+class PipedCBC(COIN_CMD):
+    """CBC that reads the model from its standard input rather than from an .mps file (see solver(self, prob))"""
+    timelimit_solution = False # CBC stopped on its time limit with an integer solution (PuLP reports this as Not Solved, like a stop without one)
+    def solve_CBC(self, lp, use_mps=True):
+        """same as COIN_CMD.solve_CBC, but the model goes through a pipe; only the solution comes back through a (small) file"""
+        if not self.executable(self.path):
+            raise PulpSolverError("Pulp: cannot execute %s cwd: %s" % (self.path, os.getcwd()))
+        tmpSol = os.path.join(self.tmpDir, "%d-pulp.sol" % os.getpid())
+        if os.path.exists(tmpSol):
+            os.remove(tmpSol) # NB: otherwise a failed run would read the solution of the previous scenario
+        cmds = ["-import", "stdin"]
+        if lp.sense == LpMaximize:
+            cmds += ["max"]
+        if self.threads:
+            cmds += ["threads", str(self.threads)]
+        if self.fracGap is not None:
+            cmds += ["ratio", str(self.fracGap)]
+        if self.maxSeconds is not None:
+            cmds += ["sec", str(self.maxSeconds)]
+        if self.presolve:
+            cmds += ["presolve", "on"]
+        if self.strong:
+            cmds += ["strong", str(self.strong)]
+        if self.cuts:
+            cmds += ["gomory", "on", "knapsack", "on", "probing", "on"]
+        cmds += list(self.options) # NB: one argument per item, so paths with spaces (e.g. the MIP start) stay intact
+        cmds += ["branch" if self.mip else "initialSolve", "printingOptions", "all", "solution", tmpSol]
+        pipe = None if self.msg else open(os.devnull, 'w')
+        cbc = subprocess.Popen([self.path] + cmds, stdin=subprocess.PIPE, stdout=pipe, stderr=pipe, bufsize=-1)
+        try:
+            variablesNames, constraintsNames, objectiveName = self.write_mps(lp, cbc.stdin)
+            cbc.stdin.close()
+        except IOError: # CBC stopped reading, the exit code below tells why
+            variablesNames, constraintsNames, objectiveName = None, None, None
+        if cbc.wait() != 0 or variablesNames is None:
+            raise PulpSolverError("Pulp: Error while trying to execute " + self.path)
+        if not os.path.exists(tmpSol):
+            raise PulpSolverError("Pulp: Error while executing " + self.path)
+        lp.status, values, reducedCosts, shadowPrices, slacks = self.readsol_MPS(tmpSol, lp, lp.variables(), variablesNames, constraintsNames, objectiveName)
+        f = open(tmpSol)
+        status = f.readline() # e.g. "Stopped on time - objective value 123", or "Stopped on time (no integer solution - continuous used) - objective value 120"
+        f.close()
+        self.timelimit_solution = status.startswith("Stopped on time") and "no integer solution" not in status
+        lp.assignVarsVals(values)
+        lp.assignVarsDj(reducedCosts)
+        lp.assignConsPi(shadowPrices)
+        lp.assignConsSlack(slacks, activity=True)
+        try:
+            os.remove(tmpSol)
+        except OSError:
+            pass
+        return lp.status
+    def write_mps(self, lp, f):
+        """writes lp to f in the same format as LpProblem.writeMPS(rename=1), returns the normalised names of the variables, constraints and objective"""
+        wasNone, dummyVar = lp.fixObjective()
+        constraintsNames, variablesNames, objName = lp.normalisedNames()
+        cobj = lp.objective
+        vs = lp.variables()
+        f.write("*SENSE:" + LpSenses[lp.sense] + "\n")
+        f.write("NAME          MODEL\n")
+        f.write("ROWS\n")
+        f.write(" N  %s\n" % objName)
+        mpsConstraintType = {LpConstraintLE:"L", LpConstraintEQ:"E", LpConstraintGE:"G"}
+        coefs = {} # variable -> constraint -> coefficient
+        for k, c in lp.constraints.iteritems():
+            k = constraintsNames[k]
+            f.write(" " + mpsConstraintType[c.sense] + "  " + k + "\n")
+            for v, a in c.iteritems():
+                coefs.setdefault(variablesNames[v.name],{})[k] = a
+        f.write("COLUMNS\n")
+        for v in vs:
+            n = variablesNames[v.name]
+            lines = ["    %-8s  %-8s  % .12e\n" % (n,k,a) for k, a in coefs.get(n,{}).iteritems()]
+            if v in cobj:
+                lines.append("    %-8s  %-8s  % .12e\n" % (n,objName,cobj[v]))
+            if v.cat == LpInteger:
+                lines = ["    MARK      'MARKER'                 'INTORG'\n"] + lines + ["    MARK      'MARKER'                 'INTEND'\n"]
+            f.write("".join(lines))
+        f.write("RHS\n")
+        for k, c in lp.constraints.iteritems():
+            f.write("    RHS       %-8s  % .12e\n" % (constraintsNames[k], -c.constant if c.constant != 0 else 0))
+        f.write("BOUNDS\n")
+        for v in vs:
+            n = variablesNames[v.name]
+            if v.lowBound is not None and v.lowBound == v.upBound:
+                f.write(" FX BND       %-8s  % .12e\n" % (n, v.lowBound))
+            elif v.lowBound == 0 and v.upBound == 1 and v.cat == LpInteger:
+                f.write(" BV BND       %-8s\n" % n)
+            else:
+                if v.lowBound is not None:
+                    if v.lowBound != 0 or (v.cat == LpInteger and v.upBound is None): # NB: COIN reads integers without bounds as binaries
+                        f.write(" LO BND       %-8s  % .12e\n" % (n, v.lowBound))
+                elif v.upBound is not None:
+                    f.write(" MI BND       %-8s\n" % n)
+                else:
+                    f.write(" FR BND       %-8s\n" % n)
+                if v.upBound is not None:
+                    f.write(" UP BND       %-8s  % .12e\n" % (n, v.upBound))
+        f.write("ENDATA\n")
+        lp.restoreObjective(wasNone, dummyVar)
+        return variablesNames, constraintsNames, objName
+
+class ProcessMemoryCounters(ctypes.Structure):
+    """PROCESS_MEMORY_COUNTERS of the Windows psapi, filled by GetProcessMemoryInfo (see peak_memory(self))"""
+    _fields_ = [("cb", ctypes.c_ulong),
+                ("PageFaultCount", ctypes.c_ulong),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t)]
+
 class McListBox(object):
     """use a ttk.TreeView as a multicolumn ListBox"""
     def __init__(self,header,data):
@@ -7725,17 +8698,42 @@ def sortby(tree, col, descending):
 ################## Executed code #######################################################
 ########################################################################################
 
-rootWin = Tk()
-rootWin.title("AID-M: WFP's Assistant for Integrated Decision-Making")
-script_dir = os.path.dirname(os.path.abspath(__file__))
-dest_dir = os.path.join(script_dir, 'data')
-dest_dir = os.path.join(dest_dir, 'wfp.ico')
-rootWin.wm_iconbitmap(dest_dir)
-bgcolor = '#%02x%02x%02x' % (51, 128, 255)
-rootWin.configure(background=bgcolor)
-
-app = UNWFPModel(rootWin)
-rootWin.mainloop()
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        # Command line: solve saved scenarios without GUI, e.g.
+        #   python "AID-M v0.9.0.1 Syria.py" "Current basket" "Scenario_002"
+        #   python "AID-M v0.9.0.1 Syria.py" --all
+        parser = argparse.ArgumentParser(description="Solve saved AID-M scenarios without the GUI")
+        parser.add_argument("scenarios", nargs="*", help="names of scenarios in the 'saved' folder")
+        parser.add_argument("--all", action="store_true", help="solve all scenarios in the 'saved' folder")
+        parser.add_argument("--write-lp", action="store_true", help="write each model to AIDM.lp before solving it (debugging)")
+        parser.add_argument("--no-bigm-presolve", action="store_true", help="use the generic big-Ms, to compare the solve times in Profile.csv")
+        args = parser.parse_args()
+        names = list(args.scenarios)
+        if args.all:
+            script_dir = os.path.dirname(os.path.abspath(__file__))
+            mypath = os.path.join(script_dir, 'saved')
+            for (dirpath, dirnames, filenames) in os.walk(mypath):
+                names.extend(sorted(f for f in dirnames if not f.lower().startswith('backup')))
+                break
+        if len(names) == 0:
+            parser.error("no scenarios to solve")
+        app = UNWFPModel()
+        app.writelp = int(args.write_lp)
+        app.tighten = 0 if args.no_bigm_presolve else 1
+        sys.exit(1 if app.run_scenarios(names) > 0 else 0)
+    else:
+        rootWin = Tk()
+        rootWin.title("AID-M: WFP's Assistant for Integrated Decision-Making")
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        dest_dir = os.path.join(script_dir, 'data')
+        dest_dir = os.path.join(dest_dir, 'wfp.ico')
+        rootWin.wm_iconbitmap(dest_dir)
+        bgcolor = '#%02x%02x%02x' % (51, 128, 255)
+        rootWin.configure(background=bgcolor)
+
+        app = UNWFPModel(rootWin)
+        rootWin.mainloop()
 
 
 